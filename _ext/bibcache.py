@@ -0,0 +1,98 @@
+"""On-disk cache of the parsed bibliography.
+
+sphinxcontrib-bibtex parses the .bib files again whenever their
+modification time differs from the one in the Sphinx environment, which
+is every build from a fresh checkout. This extension keeps the parsed
+database in a pickle under the doctree directory, named after the sha256
+of the .bib files. When they have not changed the bibliography is not
+parsed at all.
+
+The versions of the libraries whose objects are pickled are part of the
+name too, and a pickle that cannot be loaded for any reason is ignored.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+# Distributions whose classes end up in the pickle
+LIBRARIES = ('pybtex', 'sphinxcontrib-bibtex')
+
+_cache = {'path': None, 'dirty': False}
+
+
+def _bibfiles(app):
+    return [(Path(app.confdir) / f).resolve()
+            for f in app.config.bibtex_bibfiles]
+
+
+def _versions():
+    from importlib import metadata
+    versions = []
+    for name in LIBRARIES:
+        try:
+            versions.append('%s=%s' % (name, metadata.version(name)))
+        except metadata.PackageNotFoundError:
+            versions.append('%s=missing' % name)
+    return ' '.join(versions)
+
+
+def _digest(bibfiles, encoding):
+    h = hashlib.sha256(('%s %s' % (encoding, _versions())).encode())
+    for filename in bibfiles:
+        h.update(str(filename).encode())
+        try:
+            h.update(filename.read_bytes())
+        except OSError:
+            h.update(b'missing')
+    return h.hexdigest()
+
+
+def builder_inited(app):
+    from sphinxcontrib.bibtex.bibfile import BibData, BibFile, get_mtime
+
+    bibfiles = _bibfiles(app)
+    encoding = app.config.bibtex_encoding
+    cache_dir = os.path.join(app.doctreedir, 'bibcache')
+    path = os.path.join(cache_dir, _digest(bibfiles, encoding) + '.pickle')
+    _cache.update(path=path, dirty=True)
+    try:
+        with open(path, 'rb') as f:
+            bibdata = pickle.load(f)
+        # Hand sphinxcontrib-bibtex the cached database with the current
+        # modification times, so that it finds it up to date
+        bibdata = BibData(
+            encoding=bibdata.encoding,
+            bibfiles={filename: BibFile(mtime=get_mtime(filename),
+                                        keys=bf.keys)
+                      for filename, bf in bibdata.bibfiles.items()},
+            data=bibdata.data)
+    except Exception:
+        # Missing, truncated or written by other library versions: a miss
+        return
+    app.env.get_domain('cite').data['bibdata'] = bibdata
+    _cache['dirty'] = False
+
+
+def build_finished(app, exception):
+    path = _cache['path']
+    if exception is not None or path is None or not _cache['dirty']:
+        return
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    bibdata = app.env.get_domain('cite').bibdata
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(bibdata, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pickle') and name != os.path.basename(path):
+            os.remove(os.path.join(cache_dir, name))
+    _cache['dirty'] = False
+
+
+def setup(app):
+    # Run before sphinxcontrib-bibtex looks at the .bib files
+    app.connect('builder-inited', builder_inited, priority=400)
+    app.connect('build-finished', build_finished)
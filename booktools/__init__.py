@@ -0,0 +1,17 @@
+"""Helpers used by run_notebooks.py and build.sh to build the book."""
+
+
+def add_hook(ep, name, hook):
+    """Add hook to ep's name hook (e.g. 'on_cell_executed').
+
+    nbclient has a single slot for each hook; this keeps whatever was
+    there already and calls it before hook.
+    """
+    previous = getattr(ep, name)
+
+    def both(**kwargs):
+        if previous is not None:
+            previous(**kwargs)
+        hook(**kwargs)
+
+    setattr(ep, name, both)
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""Timing of the build pipeline, one phase at a time.
+
+Runs the phases of a book build separately and appends their timings to
+a history file (JSON lines), then compares each phase with the median of
+its recent runs on the same machine and flags the ones that got slower
+by more than a threshold:
+
+    execute       run_notebooks.py over the table of contents
+    html          jupyter-book build (Sphinx; notebooks from jupyter-cache)
+    images        booktools.images on the built HTML
+    bibliography  parsing and formatting references.bib with the book style
+    publish       hashing the HTML and diffing it against the last publish
+
+Usage (from the repository root):
+
+    python -m booktools.bench [--phases execute,html] [--threshold 0.2]
+
+The exit status is 1 if any phase regressed, so it can gate a CI job.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY = os.path.join(ROOT, '.nbcache', 'bench.jsonl')
+PHASES = ('execute', 'html', 'images', 'bibliography', 'publish')
+
+
+def run_execute(args):
+    cmd = [sys.executable, os.path.join(ROOT, 'run_notebooks.py'),
+           '--toc', os.path.join(ROOT, 'yaml', '_toc.yml'), '--local-data',
+           '-j', str(args.jobs)]
+    if args.cold:
+        cmd.append('--no-cache')
+    if subprocess.call(cmd, cwd=os.path.join(ROOT, 'Chapters')):
+        raise RuntimeError('run_notebooks.py failed')
+
+
+def run_html(args):
+    from booktools.build import jupyter_book_build
+    if jupyter_book_build():
+        raise RuntimeError('jupyter-book build failed')
+
+
+def run_images(args):
+    from booktools import images
+    images.optimise(jobs=args.jobs)
+
+
+def run_bibliography(args):
+    from pybtex.database import parse_file
+    from pybtex.plugin import register_plugin
+    from pybtex.style.template import FieldIsMissing
+
+    sys.path.insert(0, os.path.join(ROOT, '_ext'))
+    import apastyle
+    register_plugin('pybtex.style.labels', 'myapa', apastyle.MyAPALabelStyle)
+    data = parse_file(os.path.join(ROOT, 'Chapters', 'references.bib'))
+    style = apastyle.MyAPAStyle()
+    entries = style.sort(data.entries.values())
+    for label, entry in zip(style.format_labels(entries), entries):
+        try:
+            style.format_entry(label, entry)
+        except FieldIsMissing:
+            pass  # incomplete entries still cost the time spent on them
+
+
+def run_publish(args):
+    from booktools import publish
+    new = publish.tree_manifest(publish.HTML_DIR)
+    if os.path.isdir(publish.WORKTREE):
+        publish.diff(publish.published_manifest(), new)
+
+
+RUNNERS = {'execute': run_execute, 'html': run_html, 'images': run_images,
+           'bibliography': run_bibliography, 'publish': run_publish}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    history = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    pass  # a torn last line
+    except FileNotFoundError:
+        pass
+    return history
+
+
+def regressions(record, history, threshold, window):
+    """Return (phase, seconds, baseline) for each phase that got slower.
+
+    The baseline is the median time of the phase over the last window
+    runs on the same host.
+    """
+    found = []
+    for phase, seconds in record['phases'].items():
+        previous = [r['phases'][phase] for r in history
+                    if r.get('host') == record['host']
+                    and phase in r.get('phases', {})][-window:]
+        if not previous:
+            continue
+        baseline = statistics.median(previous)
+        if seconds > baseline * (1 + threshold):
+            found.append((phase, seconds, baseline))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the phases of the \
+        book build and flags the ones that got slower.")
+    parser.add_argument('--phases', default=','.join(PHASES), help='Comma \
+        separated phases to run (default: %s).' % ','.join(PHASES))
+    parser.add_argument('--history', default=HISTORY, help='The history \
+        file (default: .nbcache/bench.jsonl).')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Flag \
+        a phase that is slower than its baseline by more than this \
+        fraction (default 0.2).')
+    parser.add_argument('--window', type=int, default=5, help='Number of \
+        earlier runs whose median is the baseline (default 5).')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='Parallel jobs for the execute and images phases (default: \
+        number of CPUs).')
+    parser.add_argument('--cold', help='Execute every notebook, ignoring \
+        the cell cache.', action='store_true')
+    args = parser.parse_args()
+
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    unknown = sorted(set(phases) - set(PHASES))
+    if unknown:
+        parser.error('unknown phase(s): %s' % ', '.join(unknown))
+
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit': git_commit(), 'host': platform.node(),
+              'cold': args.cold, 'phases': {}}
+    for phase in phases:
+        print('*** %s' % phase)
+        start = time.perf_counter()
+        RUNNERS[phase](args)
+        record['phases'][phase] = round(time.perf_counter() - start, 3)
+
+    history = load_history(args.history)
+    history = [r for r in history if r.get('cold') == args.cold]
+    found = regressions(record, history, args.threshold, args.window)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    print('*****')
+    print('Build phases:')
+    slow = {phase: baseline for phase, seconds, baseline in found}
+    for phase, seconds in record['phases'].items():
+        note = ''
+        if phase in slow:
+            note = '  REGRESSION (baseline %.1f s, +%.0f%%)' % (
+                slow[phase], 100 * (seconds / slow[phase] - 1))
+        print('  %-15s %8.1f s%s' % (phase, seconds, note))
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
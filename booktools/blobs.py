@@ -0,0 +1,120 @@
+# coding: utf-8
+"""Sidecar store for large notebook outputs.
+
+The figures in an executed chapter are base64 PNGs embedded in the
+notebook, and nbclient keeps the whole notebook in memory until it is
+written. BlobStore moves every output payload above a size threshold to a
+content-addressed file as soon as its cell has finished, and leaves a
+small reference in its place:
+
+    "application/vnd.booktools.blob+json": {
+        "image/png": {"sha256": "...", "size": 12345}}
+
+so memory use does not grow with the number of figures, and identical
+figures are stored once. restore() puts the payloads back, for tools that
+need a self-contained notebook:
+
+    python -m booktools.blobs BLOB_DIR my_nb_out.ipynb [...]
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import tempfile
+
+import nbformat
+
+from booktools import add_hook
+
+BLOB_MIMETYPE = 'application/vnd.booktools.blob+json'
+
+
+def _is_base64(mimetype):
+    return mimetype.startswith('image/') and not mimetype.endswith('+xml')
+
+
+class BlobStore:
+    """Content-addressed files under root, one per distinct payload."""
+
+    def __init__(self, root, threshold=16 * 1024):
+        self.root = root
+        self.threshold = threshold
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        """Store bytes and return their sha256."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def offload(self, cell):
+        """Replace the large payloads in cell's outputs by references."""
+        for output in cell.get('outputs', []):
+            data = output.get('data')
+            if not data:
+                continue
+            refs = {}
+            for mimetype in list(data):
+                value = data[mimetype]
+                if isinstance(value, list):
+                    value = ''.join(value)
+                if not isinstance(value, str) or len(value) < self.threshold:
+                    continue
+                if _is_base64(mimetype):
+                    raw = base64.b64decode(value)
+                else:
+                    raw = value.encode('utf-8')
+                del data[mimetype]
+                refs[mimetype] = {'sha256': self.put(raw), 'size': len(raw)}
+            if refs:
+                data[BLOB_MIMETYPE] = refs
+
+    def restore(self, nb):
+        """Put the stored payloads back into every output of nb."""
+        for cell in nb.cells:
+            for output in cell.get('outputs', []):
+                data = output.get('data')
+                if not data or BLOB_MIMETYPE not in data:
+                    continue
+                for mimetype, ref in data.pop(BLOB_MIMETYPE).items():
+                    raw = self.get(ref['sha256'])
+                    if _is_base64(mimetype):
+                        data[mimetype] = base64.b64encode(raw).decode()
+                    else:
+                        data[mimetype] = raw.decode('utf-8')
+        return nb
+
+    def attach(self, ep):
+        """Offload each cell's outputs as soon as ep has executed it."""
+        add_hook(ep, 'on_cell_executed',
+                 lambda cell, **kwargs: self.offload(cell))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Puts the outputs kept in \
+        a blob store back into executed notebooks.")
+    parser.add_argument('blob_dir', help='The blob store directory.')
+    parser.add_argument('file_list', metavar='F', type=str, nargs='+',
+        help='Notebook file(s) to restore in place.')
+    args = parser.parse_args()
+    store = BlobStore(args.blob_dir)
+    for path in args.file_list:
+        nb = nbformat.read(path, as_version=4)
+        nbformat.write(store.restore(nb), path)
+
+
+if __name__ == '__main__':
+    main()
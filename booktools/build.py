@@ -0,0 +1,186 @@
+# coding: utf-8
+"""Incremental build of the book.
+
+yaml/_config.yml runs jupyter-book with `execute_notebooks: cache`, so
+executed notebooks are kept in a jupyter-cache database between builds and
+only notebooks whose code cells changed are executed again. jupyter-cache
+only looks at the code, so before building we also drop the cached copy of
+any notebook whose Data/ files changed since the last build. After the
+build we report which notebooks came from the cache and the execution time
+that saved.
+
+The kernels get the repository root on PYTHONPATH and run
+pythonbook/kernel_startup.py, so the chapters read their data from Data/
+rather than from GitHub. The data files are converted to Arrow files
+first (see pythonbook.datasets), so that no kernel has to parse them. A
+data file that no longer matches Data/SHA256SUMS stops the build before
+anything is executed; refresh the checksums with
+`python -m pythonbook.datasets --update` if the change is intended.
+After a successful build the images in the HTML are optimised (see
+booktools/images.py).
+
+Usage (from the repository root):
+
+    python -m booktools.build [--force]
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import nbformat
+
+from booktools import images
+from booktools.cache import data_files, file_hash
+from pythonbook import datasets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAPTERS_DIR = os.path.join(ROOT, 'Chapters')
+DATA_DIR = os.path.join(ROOT, 'Data')
+BOOK_DIR = os.path.join(ROOT, 'Book')
+CACHE_DIR = os.path.join(BOOK_DIR, '_build', '.jupyter_cache')
+MANIFEST = os.path.join(BOOK_DIR, '_build', '.data_manifest.json')
+
+
+def data_manifest(notebooks):
+    """Map each notebook to the hashes of the Data/ files it reads."""
+    manifest = {}
+    for path in notebooks:
+        nb = nbformat.read(path, as_version=4)
+        manifest[os.path.basename(path)] = {
+            os.path.basename(f): file_hash(f)
+            for f in data_files(nb, DATA_DIR)}
+    return manifest
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def changed_data():
+    """Return a message for each data file that fails its checksum."""
+    messages = []
+    for name in datasets.names():
+        try:
+            datasets.verify(name)
+        except ValueError as e:
+            messages.append(str(e))
+    return messages
+
+
+def open_cache():
+    """Return the jupyter-cache database, or None before the first build."""
+    if not os.path.isdir(CACHE_DIR):
+        return None
+    from jupyter_cache import get_cache
+    return get_cache(CACHE_DIR)
+
+
+def match_records(cache, notebooks):
+    """Map notebook name to its cache record, for notebooks with one."""
+    records = {}
+    if cache is None:
+        return records
+    for path in notebooks:
+        try:
+            records[os.path.basename(path)] = cache.match_cache_file(path)
+        except KeyError:
+            pass
+    return records
+
+
+def invalidate_changed_data(cache, records, old, new):
+    """Drop cache records of notebooks whose data files changed."""
+    stale = sorted(name for name in records
+                   if name in old and old[name] != new[name])
+    for name in stale:
+        cache.remove_cache(records.pop(name).pk)
+    return stale
+
+
+def jupyter_book_build():
+    cmd = ['jupyter-book', 'build', CHAPTERS_DIR,
+           '--path-output', BOOK_DIR,
+           '--config', os.path.join(ROOT, 'yaml', '_config.yml'),
+           '--toc', os.path.join(ROOT, 'yaml', '_toc.yml')]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in [ROOT, env.get('PYTHONPATH')] if p)
+    env['PYTHONSTARTUP'] = os.path.join(ROOT, 'pythonbook',
+                                        'kernel_startup.py')
+    return subprocess.call(cmd, env=env)
+
+
+def print_report(notebooks, records, stale):
+    print('*****')
+    print('Notebook execution:')
+    saved = 0.0
+    for path in notebooks:
+        name = os.path.basename(path)
+        if name in records:
+            seconds = (records[name].data or {}).get('execution_seconds')
+            saved += seconds or 0.0
+            how = 'cached'
+            if seconds is not None:
+                how += ' (saved %.1f s)' % seconds
+        elif name in stale:
+            how = 'executed (data changed)'
+        else:
+            how = 'executed'
+        print('  %-45s %s' % (name, how))
+    print('%d of %d notebook(s) served from cache, %.1f s of execution saved.'
+          % (len(records), len(notebooks), saved))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the book, \
+        re-executing only notebooks whose code or data changed.")
+    parser.add_argument('-f', '--force', help='Clear the execution cache \
+        and re-execute every notebook.', action='store_true')
+    args = parser.parse_args()
+
+    # The kernels would fail on the same check, one traceback per notebook
+    messages = changed_data()
+    if messages:
+        print('\n'.join(messages))
+        return 1
+
+    if args.force and os.path.isdir(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+
+    notebooks = sorted(glob.glob(os.path.join(CHAPTERS_DIR, '*.ipynb')))
+    manifest = data_manifest(notebooks)
+    cache = open_cache()
+    records = match_records(cache, notebooks)
+    stale = invalidate_changed_data(cache, records, load_manifest(), manifest)
+
+    try:
+        datasets.convert_all()
+    except ImportError:
+        pass  # no pyarrow; the kernels parse the CSV files
+
+    status = jupyter_book_build()
+    if status == 0:
+        os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+        with open(MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print('Pillow is not installed; images left as they are.')
+        else:
+            images.optimise()
+    print_report(notebooks, records, stale)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# coding: utf-8
+"""Content-addressed cache of executed notebook cells.
+
+Every code cell gets a key made from its own source, the key of the code
+cell before it, the kernel name, the form the outputs are stored in and
+the contents of the Data/ files the notebook reads. Because the keys are
+chained, editing a cell invalidates that cell and everything after it,
+while editing a markdown cell changes nothing at all.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import nbformat
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    """Return the sha256 of the file at path, memoised per process."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[memo_key] = h.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def data_files(nb, data_dir):
+    """Return the files in data_dir whose names appear in nb's code cells."""
+    if not data_dir or not os.path.isdir(data_dir):
+        return []
+    source = '\n'.join(c.source for c in nb.cells if c.cell_type == 'code')
+    return sorted(os.path.join(data_dir, name)
+                  for name in os.listdir(data_dir)
+                  if not name.startswith('.') and name in source)
+
+
+def cell_keys(nb, kernel_name, data_dir=None, variant=None):
+    """Return one cache key per cell of nb (None for non-code cells).
+
+    variant names anything else that changes what the stored outputs look
+    like, such as outputs kept in a blob store rather than in the cell.
+    """
+    h = hashlib.sha256()
+    h.update(kernel_name.encode())
+    if variant:
+        h.update(variant.encode())
+    for path in data_files(nb, data_dir):
+        h.update(os.path.basename(path).encode())
+        h.update(file_hash(path).encode())
+    previous = h.hexdigest()
+    keys = []
+    for cell in nb.cells:
+        if cell.cell_type != 'code':
+            keys.append(None)
+            continue
+        h = hashlib.sha256()
+        h.update(previous.encode())
+        h.update(cell.source.encode())
+        previous = h.hexdigest()
+        keys.append(previous)
+    return keys
+
+
+class CellCache:
+    """Stores cell outputs on disk under cache_dir, one file per key."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'cells', key[:2], key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, cell):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'execution_count': cell.get('execution_count'),
+                 'outputs': cell.get('outputs', [])}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wt') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def first_miss(self, keys):
+        """Return the index of the first cell not in the cache, or None."""
+        for i, key in enumerate(keys):
+            if key is not None and not os.path.exists(self._path(key)):
+                return i
+        return None
+
+    def replay(self, nb, keys):
+        """Copy cached outputs into nb. Returns False if any cell misses."""
+        entries = []
+        for cell, key in zip(nb.cells, keys):
+            if key is None:
+                continue
+            entry = self.get(key)
+            if entry is None:
+                return False
+            entries.append((cell, entry))
+        for cell, entry in entries:
+            cell.execution_count = entry['execution_count']
+            cell.outputs = [nbformat.from_dict(o) for o in entry['outputs']]
+        return True
+
+    def store(self, nb, keys):
+        """Store the outputs of every code cell of nb."""
+        for cell, key in zip(nb.cells, keys):
+            if key is not None:
+                self.put(key, cell)
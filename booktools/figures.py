@@ -0,0 +1,200 @@
+# coding: utf-8
+"""Deferred, parallel rendering of matplotlib figures.
+
+Drawing a seaborn figure to PNG is a good part of the time spent in the
+figure-heavy chapters, and it happens one figure at a time in the kernel.
+install() runs inside the kernel and replaces IPython's PNG printer, so
+that instead of drawing, each displayed or glued figure is pickled (its
+"spec") into figure_dir/spec/ and a placeholder PNG is shown whose output
+metadata names the spec:
+
+    "metadata": {"image/png": {"booktools.figure": "<sha256 of the spec>"}}
+
+After the notebook has run, render() draws all the specs it refers to in
+a pool of processes and puts the PNGs in place of the placeholders. PNGs
+are kept in figure_dir/png/ under the same key, so a figure whose spec
+has not changed is never drawn again. Figures that cannot be pickled are
+drawn in the kernel as usual.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+FIGURE_KEY = 'booktools.figure'
+
+# A 1x1 transparent PNG shown until the real figure has been drawn
+PLACEHOLDER = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk'
+               '+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+class SpecPickler(pickle.Pickler):
+    """Pickles figures so that the same figure gives the same bytes.
+
+    matplotlib transforms keep their parents in a dict keyed by id(),
+    which differs from run to run; here those keys are renumbered in the
+    order they are met.
+    """
+
+    def __init__(self, f):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._ids = {}
+
+    def reducer_override(self, obj):
+        from matplotlib.transforms import TransformNode
+        if not isinstance(obj, TransformNode):
+            return NotImplemented
+        reduced = list(obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL))
+        state = dict(reduced[2])
+        state['_parents'] = {self._ids.setdefault(k, len(self._ids)): v
+                             for k, v in state['_parents'].items()}
+        reduced[2] = state
+        return tuple(reduced)
+
+
+def _write(path, data):
+    """Write data to path atomically.
+
+    Several kernels or workers may write the same figure at once, so each
+    writes its own temporary file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def dumps_spec(fig, bbox_inches, kwargs):
+    f = io.BytesIO()
+    SpecPickler(f).dump((fig, bbox_inches, kwargs))
+    return f.getvalue()
+
+
+def install(figure_dir):
+    """Defer the PNG rendering of figures in this IPython kernel."""
+    import IPython.core.pylabtools as pylabtools
+    from IPython import get_ipython
+
+    draw = pylabtools.print_figure
+    if getattr(draw, 'deferred', False):
+        return
+    spec_dir = os.path.join(figure_dir, 'spec')
+    os.makedirs(spec_dir, exist_ok=True)
+
+    def print_figure(fig, fmt='png', bbox_inches='tight', base64=False,
+                     **kwargs):
+        if fmt != 'png' or not base64 or (not fig.axes and not fig.lines):
+            return draw(fig, fmt, bbox_inches, base64, **kwargs)
+        try:
+            spec = dumps_spec(fig, bbox_inches, kwargs)
+        except Exception:
+            return draw(fig, fmt, bbox_inches, base64, **kwargs)
+        key = hashlib.sha256(spec).hexdigest()
+        path = os.path.join(spec_dir, key + '.pickle')
+        if not os.path.exists(path):
+            _write(path, spec)
+        return PLACEHOLDER, {FIGURE_KEY: key}
+
+    print_figure.deferred = True
+    pylabtools.print_figure = print_figure
+
+    # The inline backend may already have registered the old printer
+    ip = get_ipython()
+    if ip is not None and 'matplotlib.pyplot' in sys.modules:
+        from matplotlib_inline.backend_inline import InlineBackend
+        cfg = InlineBackend.instance()
+        pylabtools.select_figure_formats(ip, cfg.figure_formats,
+                                         **cfg.print_figure_kwargs)
+
+
+def install_code(figure_dir):
+    """Return code that runs install() in a kernel."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return ('import sys as _sys\n'
+            'if %(root)r not in _sys.path:\n'
+            '    _sys.path.append(%(root)r)\n'
+            'import booktools.figures as _figures\n'
+            '_figures.install(%(dir)r)\n'
+            'del _sys, _figures\n'
+            % {'root': root, 'dir': os.path.abspath(figure_dir)})
+
+
+def attach(ep, figure_dir):
+    """Run install() in ep's kernel before the first cell."""
+    from nbclient.util import run_hook
+
+    code = install_code(figure_dir)
+    previous = ep.on_notebook_start
+
+    async def on_notebook_start(**kwargs):
+        await run_hook(previous, **kwargs)
+        msg_id = ep.kc.execute(code, silent=True, store_history=False)
+        await ep.async_wait_for_reply(msg_id)
+
+    ep.on_notebook_start = on_notebook_start
+
+
+def _render(spec_path, png_path):
+    """Draw one pickled figure to png_path. Runs in a worker process."""
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    from IPython.core.pylabtools import print_figure
+
+    with open(spec_path, 'rb') as f:
+        fig, bbox_inches, kwargs = pickle.load(f)
+    data = print_figure(fig, 'png', bbox_inches, **kwargs)
+    plt.close(fig)
+    _write(png_path, data)
+    return png_path
+
+
+def _placeholders(nb):
+    """Yield (data, mimetype, key) for every deferred figure in nb."""
+    for cell in nb.cells:
+        for output in cell.get('outputs', []):
+            data = output.get('data', {})
+            for mimetype, md in output.get('metadata', {}).items():
+                if not isinstance(md, dict) or FIGURE_KEY not in md:
+                    continue
+                # glue() stores the figure under a prefixed mimetype
+                for name in data:
+                    if name == mimetype or name.endswith('/' + mimetype):
+                        yield data, name, md[FIGURE_KEY]
+
+
+def render(nb, figure_dir, jobs=None):
+    """Replace the placeholders in nb by rendered PNGs.
+
+    Returns the number of figures that had to be drawn; the others came
+    from figure_dir/png/. Placeholders whose spec is missing are left.
+    """
+    spec_dir = os.path.join(figure_dir, 'spec')
+    png_dir = os.path.join(figure_dir, 'png')
+    os.makedirs(png_dir, exist_ok=True)
+    found = list(_placeholders(nb))
+    todo = {}
+    for data, name, key in found:
+        png = os.path.join(png_dir, key + '.png')
+        spec = os.path.join(spec_dir, key + '.pickle')
+        if not os.path.exists(png) and os.path.exists(spec):
+            todo[key] = (spec, png)
+    if len(todo) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for future in [pool.submit(_render, *paths)
+                           for paths in todo.values()]:
+                future.result()
+    else:
+        for paths in todo.values():
+            _render(*paths)
+    for data, name, key in found:
+        png = os.path.join(png_dir, key + '.png')
+        if os.path.exists(png):
+            with open(png, 'rb') as f:
+                data[name] = base64.b64encode(f.read()).decode('ascii')
+    return len(todo)
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""Per-cell time and memory limits for executed notebooks.
+
+A cell can set its own limits with tags:
+
+    timeout-120       stop the cell after 120 seconds
+    max-memory-2G     stop the cell when the kernel uses more than 2 GB
+                      (K, M and G suffixes are understood)
+
+Cells without tags get the limits given to CellGuard. When a cell goes
+over a limit the kernel is interrupted, so the kernel and everything
+already computed survive; the cell gets an error output saying which limit
+it hit and cell.metadata['guard'] records the details. By default this
+stops the notebook like any other error. With keep_going the error is
+tolerated and the remaining cells are executed.
+
+Memory limits need psutil and are ignored without it.
+"""
+
+import signal
+import threading
+
+import nbformat
+
+from booktools import add_hook
+from booktools.profiling import kernel_pid
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+TIMEOUT_ERROR = 'CellTimeoutError'
+MEMORY_ERROR = 'CellMemoryError'
+
+_UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+
+
+def parse_size(text):
+    """Convert '512M', '2G' or a plain number of bytes to bytes."""
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(float(text))
+
+
+def cell_limits(cell, timeout=None, max_memory=None):
+    """Return the (timeout, max_memory) for cell, tags overriding defaults."""
+    for tag in cell.metadata.get('tags', []):
+        if tag.startswith('timeout-'):
+            timeout = float(tag[len('timeout-'):])
+        elif tag.startswith('max-memory-'):
+            max_memory = parse_size(tag[len('max-memory-'):])
+    return timeout, max_memory
+
+
+class CellGuard:
+    """Enforces cell limits on the cells executed by ep."""
+
+    def __init__(self, ep, max_memory=None, keep_going=False, interval=0.2):
+        self.ep = ep
+        self.timeout = ep.timeout
+        self.max_memory = max_memory
+        self.keep_going = keep_going
+        self.interval = interval
+        # (cell index, limit name) of every cell that was stopped
+        self.tripped = []
+        self._watch = None
+        self._stop = threading.Event()
+        self._breach = None
+
+        ep.timeout_func = self.cell_timeout
+        ep.interrupt_on_timeout = True
+        ep.error_on_timeout = {'ename': TIMEOUT_ERROR,
+                               'evalue': 'Cell execution timed out',
+                               'traceback': []}
+        if keep_going:
+            ep.allow_error_names = list(ep.allow_error_names) + [
+                TIMEOUT_ERROR, MEMORY_ERROR]
+        add_hook(ep, 'on_cell_execute', self.before_cell)
+        add_hook(ep, 'on_cell_executed', self.after_cell)
+
+    def cell_timeout(self, cell):
+        return cell_limits(cell, self.timeout)[0]
+
+    def before_cell(self, cell, cell_index, **kwargs):
+        self._breach = None
+        max_memory = cell_limits(cell, max_memory=self.max_memory)[1]
+        if max_memory and psutil is not None:
+            self._stop.clear()
+            self._watch = threading.Thread(target=self._watch_memory,
+                                           args=(max_memory,), daemon=True)
+            self._watch.start()
+
+    def _watch_memory(self, max_memory):
+        try:
+            proc = psutil.Process(kernel_pid(self.ep.km))
+            while not self._stop.wait(self.interval):
+                rss = proc.memory_info().rss
+                if rss > max_memory:
+                    self._breach = (rss, max_memory)
+                    # Signal the kernel directly: with nbclient's default
+                    # AsyncKernelManager, km.interrupt_kernel() is a
+                    # coroutine that this thread cannot run
+                    proc.send_signal(signal.SIGINT)
+                    return
+        except (psutil.Error, TypeError, ValueError):
+            return
+
+    def after_cell(self, cell, cell_index, execute_reply=None, **kwargs):
+        if self._watch is not None:
+            self._stop.set()
+            self._watch.join()
+            self._watch = None
+        content = (execute_reply or {}).get('content', {})
+        if content.get('status') != 'error':
+            return
+        if self._breach is not None:
+            rss, limit = self._breach
+            # Report the interrupt as a memory error, not KeyboardInterrupt
+            content['ename'] = MEMORY_ERROR
+            content['evalue'] = ('Kernel used %.0f MB, over the %.0f MB limit'
+                                 % (rss / 2**20, limit / 2**20))
+            self._mark(cell, cell_index, 'max-memory', content,
+                       rss_mb=round(rss / 2**20, 1),
+                       limit_mb=round(limit / 2**20, 1))
+        elif content.get('ename') == TIMEOUT_ERROR:
+            timeout = self.cell_timeout(cell)
+            content['evalue'] = 'Cell ran for more than %g s' % timeout
+            self._mark(cell, cell_index, 'timeout', content, limit_s=timeout)
+
+    def _mark(self, cell, cell_index, limit, content, **details):
+        self.tripped.append((cell_index, limit))
+        cell.metadata['guard'] = dict(limit=limit, **details)
+        cell.outputs.append(nbformat.v4.new_output(
+            'error', ename=content['ename'], evalue=content['evalue'],
+            traceback=['%s: %s' % (content['ename'], content['evalue'])]))
@@ -0,0 +1,247 @@
+# coding: utf-8
+"""Optimisation of the images in the built book.
+
+Sphinx copies every figure, from img/ as well as the PNGs drawn by the
+notebooks, into Book/_build/html/_images/. This stage then
+
+- recompresses each PNG losslessly (same pixels, better deflate), keeping
+  whichever of the two files is smaller;
+- points every <img> at one copy of each distinct image, so that a figure
+  that appears in several places is downloaded once, and hard-links the
+  other copies to it;
+- writes downscaled copies of wide images (name-480w.png, ...) and lists
+  them in the <img> srcset, so that small screens load small files.
+
+Results are kept in .nbcache/images/ by content hash, so an image is only
+processed the first time it is seen. JPEGs are deduplicated and get
+variants, but are not recompressed, as that would not be lossless.
+
+Usage (booktools.build runs this after a successful build):
+
+    python -m booktools.images [HTML_DIR]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from booktools.cache import file_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HTML_DIR = os.path.join(ROOT, 'Book', '_build', 'html')
+CACHE_DIR = os.path.join(ROOT, '.nbcache', 'images')
+IMAGE_TYPES = ('.png', '.jpg', '.jpeg')
+WIDTHS = (480, 960)
+
+_VARIANT = re.compile(r'-\d+w\.[a-z]+$')
+_IMG = re.compile(r'<img\b[^>]*>')
+_SRC = re.compile(r'\bsrc="([^"]+)"')
+
+
+def find_images(html_dir):
+    """Return the images under html_dir, leaving out our own variants."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(html_dir):
+        for name in filenames:
+            if (name.lower().endswith(IMAGE_TYPES)
+                    and not _VARIANT.search(name)):
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+
+def _temporary(dst):
+    """Return a new temporary file next to dst, with dst's extension.
+
+    Workers that optimise different images to the same bytes write the
+    same cache files at once, so each needs its own temporary name.
+    mkstemp makes the file private; pages must be able to serve it.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.tmp-',
+                               suffix=os.path.splitext(dst)[1])
+    os.close(fd)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp, 0o666 & ~umask)
+    return tmp
+
+
+def _copy(src, dst):
+    tmp = _temporary(dst)
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _save(image, dst, **kwargs):
+    tmp = _temporary(dst)
+    image.save(tmp, **kwargs)
+    os.replace(tmp, dst)
+
+
+def process(path, digest, cache_dir=CACHE_DIR, widths=WIDTHS):
+    """Optimise one image and make its variants, in the cache.
+
+    Returns (optimised file, original width, {width: variant file}).
+    Runs in a worker process.
+    """
+    from PIL import Image
+
+    ext = os.path.splitext(path)[1].lower()
+    best = os.path.join(cache_dir, digest + ext)
+    if not os.path.exists(best):
+        if ext == '.png':
+            with Image.open(path) as image:
+                kwargs = {'optimize': True}
+                if 'dpi' in image.info:
+                    kwargs['dpi'] = image.info['dpi']
+                _save(image, best, **kwargs)
+            if os.path.getsize(best) >= os.path.getsize(path):
+                _copy(path, best)
+        else:
+            _copy(path, best)
+    # The optimised file is final: remember it under its own hash too, and
+    # name the variants after it, so that it is not processed again
+    digest = file_hash(best)
+    final = os.path.join(cache_dir, digest + ext)
+    if not os.path.exists(final):
+        _copy(best, final)
+
+    with Image.open(best) as image:
+        width, height = image.size
+        variants = {}
+        for w in widths:
+            if w >= width:
+                continue
+            variant = os.path.join(cache_dir, '%s-%dw%s' % (digest, w, ext))
+            if not os.path.exists(variant):
+                small = image.resize((w, max(1, round(height * w / width))),
+                                     Image.LANCZOS)
+                _save(small, variant, optimize=True)
+            variants[w] = variant
+    return best, width, variants
+
+
+def rewrite_html(html_dir, canonical, srcsets):
+    """Point <img> tags at canonical images and give them a srcset.
+
+    canonical maps an image to the copy that pages should use, srcsets
+    maps that copy to its width and [(variant, width)]. Returns the
+    number of pages changed.
+    """
+    changed = 0
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(html_dir)):
+        for name in filenames:
+            if not name.endswith('.html'):
+                continue
+            page = os.path.join(dirpath, name)
+            with open(page, encoding='utf-8') as f:
+                text = f.read()
+
+            def fix(match):
+                tag = match.group(0)
+                src = _SRC.search(tag)
+                if src is None or '://' in src.group(1):
+                    return tag
+                target = os.path.normpath(os.path.join(dirpath, src.group(1)))
+                target = canonical.get(target, target)
+                new_src = os.path.relpath(target, dirpath).replace(os.sep, '/')
+                tag = tag.replace(src.group(0), 'src="%s"' % new_src, 1)
+                if target in srcsets and 'srcset=' not in tag:
+                    width, variants = srcsets[target]
+                    candidates = ['%s %dw' % (os.path.relpath(
+                        v, dirpath).replace(os.sep, '/'), w)
+                        for v, w in variants]
+                    candidates.append('%s %dw' % (new_src, width))
+                    tag = tag.replace(
+                        'src="%s"' % new_src,
+                        'src="%s" srcset="%s" sizes="(max-width: %dpx) 100vw,'
+                        ' %dpx"' % (new_src, ', '.join(candidates), width,
+                                    width), 1)
+                return tag
+
+            new_text = _IMG.sub(fix, text)
+            if new_text != text:
+                with open(page, 'w', encoding='utf-8') as f:
+                    f.write(new_text)
+                changed += 1
+    return changed
+
+
+def optimise(html_dir=HTML_DIR, cache_dir=CACHE_DIR, jobs=None):
+    """Optimise, deduplicate and add variants for the images in html_dir."""
+    html_dir = os.path.abspath(html_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    images = find_images(html_dir)
+    before = sum(os.path.getsize(p) for p in images)
+
+    by_digest = {}
+    for path in images:
+        by_digest.setdefault(file_hash(path), []).append(path)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {digest: pool.submit(process, paths[0], digest, cache_dir)
+                   for digest, paths in by_digest.items()}
+        results = {digest: f.result() for digest, f in futures.items()}
+
+    # Group by the optimised image, as two encodings of the same pixels
+    # often come out the same, and prefer the copy in _images/
+    groups = {}
+    for digest, paths in by_digest.items():
+        best = results[digest][0]
+        groups.setdefault(file_hash(best), (results[digest], []))[1].extend(
+            paths)
+    canonical = {}
+    srcsets = {}
+    duplicates = 0
+    for (best, width, variants), paths in groups.values():
+        paths.sort(key=lambda p: (os.sep + '_images' + os.sep not in p, p))
+        keep = paths[0]
+        if file_hash(best) != file_hash(keep):
+            _copy(best, keep)
+        stem, ext = os.path.splitext(keep)
+        placed = []
+        for w, variant in sorted(variants.items()):
+            target = '%s-%dw%s' % (stem, w, ext)
+            if (not os.path.exists(target)
+                    or file_hash(target) != file_hash(variant)):
+                _copy(variant, target)
+            placed.append((target, w))
+        if placed:
+            srcsets[keep] = (width, placed)
+        for path in paths:
+            canonical[path] = keep
+        for path in paths[1:]:
+            duplicates += 1
+            if os.path.samefile(path, keep):
+                continue
+            try:
+                os.link(keep, path + '.tmp')
+                os.replace(path + '.tmp', path)
+            except OSError:
+                _copy(keep, path)
+
+    pages = rewrite_html(html_dir, canonical, srcsets)
+    after = sum(os.path.getsize(paths[0]) for r, paths in groups.values())
+    print('%d image(s), %d duplicate(s), %.1f MB -> %.1f MB of distinct '
+          'images; %d page(s) updated.'
+          % (len(images), duplicates, before / 1e6, after / 1e6, pages))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompresses, \
+        deduplicates and adds responsive variants of the images in the \
+        built book.")
+    parser.add_argument('html_dir', nargs='?', default=HTML_DIR, help='The \
+        built HTML (default: Book/_build/html).')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of images \
+        to process in parallel (default: number of CPUs).')
+    args = parser.parse_args()
+    optimise(args.html_dir, jobs=args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
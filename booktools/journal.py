@@ -0,0 +1,81 @@
+# coding: utf-8
+"""Checkpoint journal for resumable notebook runs.
+
+run_notebooks.py appends one JSON line to the journal as each notebook
+finishes, recording the notebook, a hash of its inputs and how the run
+went. Appending a line at a time means an interrupted run loses at most
+the notebook that was executing. With --resume, notebooks whose latest
+entry succeeded for the same inputs, and whose '_out.ipynb' still exists,
+are skipped.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import nbformat
+
+from booktools.cache import data_files, file_hash
+
+DONE = ('ok', 'cached')
+
+
+def input_hash(path, kernel_name, data_dir=None):
+    """Hash the notebook file, the kernel name and the data files it reads."""
+    h = hashlib.sha256()
+    h.update(kernel_name.encode())
+    h.update(file_hash(path).encode())
+    nb = nbformat.read(path, as_version=4)
+    for f in data_files(nb, data_dir):
+        h.update(os.path.basename(f).encode())
+        h.update(file_hash(f).encode())
+    return h.hexdigest()
+
+
+class Journal:
+    """The latest journal entry for each notebook, backed by path.
+
+    seconds holds how long each notebook took the last time it was
+    executed successfully, which later cached or failed runs do not
+    tell.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.seconds = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run
+                        continue
+                    self._add(entry)
+        except OSError:
+            pass
+
+    def _add(self, entry):
+        self.entries[entry['notebook']] = entry
+        if entry['status'] == 'ok':
+            self.seconds[entry['notebook']] = entry['seconds']
+
+    def done(self, notebook, digest):
+        """True if notebook last finished successfully with these inputs."""
+        entry = self.entries.get(os.path.abspath(notebook))
+        return (entry is not None and entry['status'] in DONE
+                and entry['input_hash'] == digest)
+
+    def record(self, notebook, digest, status, seconds):
+        entry = {'notebook': os.path.abspath(notebook), 'input_hash': digest,
+                 'status': status, 'seconds': round(seconds, 2),
+                 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self._add(entry)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
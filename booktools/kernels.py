@@ -0,0 +1,125 @@
+# coding: utf-8
+"""A pool of warm Jupyter kernels.
+
+Starting a kernel and importing the scientific stack takes longer than
+running some of the short chapters. The pool starts kernels once, imports
+the libraries the chapters use, and hands the kernels out one notebook at
+a time. Before each notebook the kernel is reset: the user namespace is
+cleared, figures are closed, matplotlib settings and the working directory
+are restored and the random generators are reseeded. The imported modules
+stay loaded, so the chapters' own import cells return immediately.
+"""
+
+import os
+
+from jupyter_client import KernelManager
+
+# Run once when a kernel starts. Missing libraries are skipped so that a
+# partial environment still gets a working kernel.
+PRELOAD = """
+import importlib, os, sys, types
+for _name in ['numpy', 'pandas', 'scipy.stats', 'matplotlib.pyplot',
+              'seaborn', 'statsmodels.api', 'statsmodels.formula.api',
+              'pingouin', 'myst_nb']:
+    try:
+        importlib.import_module(_name)
+    except ImportError:
+        pass
+_warm = types.ModuleType('_warm_kernel')
+_warm.cwd = os.getcwd()
+try:
+    import matplotlib
+    _warm.rc = matplotlib.rcParams.copy()
+except ImportError:
+    _warm.rc = None
+sys.modules['_warm_kernel'] = _warm
+"""
+
+# Run before every notebook, with the notebook's run path substituted in.
+RESET = """
+get_ipython().run_line_magic('reset', '-f')
+import os, random, sys
+_warm = sys.modules['_warm_kernel']
+os.chdir(%(path)r if %(path)r else _warm.cwd)
+random.seed()
+if 'numpy' in sys.modules:
+    sys.modules['numpy'].random.seed()
+if _warm.rc is not None:
+    import matplotlib, matplotlib.pyplot
+    matplotlib.pyplot.close('all')
+    matplotlib.rcParams.update(_warm.rc)
+# clears the namespace again and restarts history and execution counts
+get_ipython().reset(new_session=True)
+"""
+
+
+class KernelPool:
+    """Keeps up to size kernels started and preloaded.
+
+    Use acquire() to get a freshly reset kernel manager for a notebook and
+    release() to give it back. A kernel that timed out or died should be
+    released with healthy=False, in which case it is shut down and a new
+    one is started in its place.
+    """
+
+    def __init__(self, size=1, kernel_name='python3', preload=PRELOAD,
+                 timeout=120):
+        self.size = size
+        self.kernel_name = kernel_name
+        self.preload = preload
+        self.timeout = timeout
+        self._idle = []
+        for _ in range(size):
+            self._idle.append(self._start())
+
+    def _start(self):
+        km = KernelManager(kernel_name=self.kernel_name)
+        # nbclient drives the kernel through an asynchronous client
+        km.client_class = 'jupyter_client.asynchronous.AsyncKernelClient'
+        km.start_kernel()
+        self._execute(km, self.preload)
+        return km
+
+    def _execute(self, km, code):
+        kc = km.blocking_client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.timeout)
+            reply = kc.execute_interactive(code, silent=True,
+                                           timeout=self.timeout,
+                                           output_hook=lambda msg: None)
+        finally:
+            kc.stop_channels()
+        if reply['content']['status'] != 'ok':
+            raise RuntimeError('Kernel setup failed: %s'
+                               % reply['content'].get('evalue'))
+
+    def acquire(self, path=''):
+        """Return a reset kernel manager whose working directory is path."""
+        path = os.path.abspath(path) if path else ''
+        while self._idle:
+            km = self._idle.pop()
+            if not km.is_alive():
+                continue
+            try:
+                self._execute(km, RESET % {'path': path})
+                return km
+            except Exception:
+                km.shutdown_kernel(now=True)
+        km = self._start()
+        self._execute(km, RESET % {'path': path})
+        return km
+
+    def release(self, km, healthy=True):
+        """Give km back to the pool, or replace it if it is unhealthy."""
+        if not healthy or not km.is_alive():
+            km.shutdown_kernel(now=True)
+            km = self._start()
+        if len(self._idle) < self.size:
+            self._idle.append(km)
+        else:
+            km.shutdown_kernel(now=True)
+
+    def shutdown(self):
+        while self._idle:
+            self._idle.pop().shutdown_kernel(now=True)
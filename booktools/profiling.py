@@ -0,0 +1,143 @@
+# coding: utf-8
+"""Per-cell timing and memory use of executed notebooks.
+
+CellProfiler hooks into an ExecutePreprocessor and, for every code cell,
+stores the wall time, the CPU time of the kernel process and how far the
+kernel's resident memory rose above its level at the start of the cell in
+cell.metadata['profile']. The memory peak is read from the kernel's
+high-water mark in /proc, which is reset before each cell, so it is only
+measured on Linux; elsewhere the RSS after the cell is used instead. CPU
+and memory figures need psutil and are left out without it.
+"""
+
+import csv
+import json
+import time
+
+from booktools import add_hook
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+FIELDS = ['notebook', 'cell', 'wall_s', 'cpu_s', 'peak_rss_delta_mb',
+          'source']
+
+
+def kernel_pid(km):
+    """Return the process id of the kernel started by km, or None."""
+    provisioner = getattr(km, 'provisioner', None)
+    if provisioner is not None and getattr(provisioner, 'pid', None):
+        return provisioner.pid
+    kernel = getattr(km, 'kernel', None)
+    return getattr(kernel, 'pid', None)
+
+
+def _peak_rss(pid):
+    """Return the kernel's peak RSS in bytes since the last reset."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss(pid):
+    try:
+        with open('/proc/%d/clear_refs' % pid, 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class CellProfiler:
+    """Records a profile for each cell executed by ep."""
+
+    def __init__(self, ep):
+        self.ep = ep
+        self._start = None
+        add_hook(ep, 'on_cell_execute', self.before_cell)
+        add_hook(ep, 'on_cell_executed', self.after_cell)
+
+    def _process(self):
+        if psutil is None:
+            return None
+        pid = kernel_pid(self.ep.km)
+        try:
+            return psutil.Process(pid) if pid else None
+        except psutil.Error:
+            return None
+
+    def before_cell(self, cell, **kwargs):
+        proc = self._process()
+        cpu = rss = None
+        if proc is not None:
+            try:
+                times = proc.cpu_times()
+                cpu = times.user + times.system
+                rss = proc.memory_info().rss
+                _reset_peak_rss(proc.pid)
+            except psutil.Error:
+                pass
+        self._start = (time.perf_counter(), cpu, rss)
+
+    def after_cell(self, cell, **kwargs):
+        if self._start is None:
+            return
+        wall0, cpu0, rss0 = self._start
+        self._start = None
+        profile = {'wall_s': round(time.perf_counter() - wall0, 4)}
+        proc = self._process()
+        if proc is not None and cpu0 is not None:
+            try:
+                times = proc.cpu_times()
+                profile['cpu_s'] = round(times.user + times.system - cpu0, 4)
+                peak = _peak_rss(proc.pid) or proc.memory_info().rss
+                profile['peak_rss_delta_mb'] = round(
+                    max(peak - rss0, 0) / 2**20, 2)
+            except psutil.Error:
+                pass
+        cell.metadata['profile'] = profile
+
+
+def cell_rows(nb, name):
+    """Return one report row per profiled cell of nb."""
+    rows = []
+    for i, cell in enumerate(nb.cells):
+        profile = cell.metadata.get('profile')
+        if cell.cell_type != 'code' or not profile:
+            continue
+        first_line = cell.source.strip().split('\n')[0][:60]
+        row = {'notebook': name, 'cell': i, 'source': first_line}
+        row.update(profile)
+        rows.append(row)
+    return rows
+
+
+def write_report(rows, path):
+    """Write rows, slowest first, as CSV if path ends in .csv else JSON."""
+    rows = sorted(rows, key=lambda r: r['wall_s'], reverse=True)
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=1)
+
+
+def print_top(rows, top=10):
+    rows = sorted(rows, key=lambda r: r['wall_s'], reverse=True)[:top]
+    if not rows:
+        return
+    print('Slowest cells:')
+    for r in rows:
+        print('  %7.2f s wall %7s s cpu %8s MB  %s [%d]  %s'
+              % (r['wall_s'], r.get('cpu_s', '-'),
+                 r.get('peak_rss_delta_mb', '-'), r['notebook'], r['cell'],
+                 r['source']))
@@ -0,0 +1,152 @@
+# coding: utf-8
+"""Incremental publishing of the built book to GitHub Pages.
+
+ghp-import rewrites the whole gh-pages tree on every publish. Here the
+gh-pages branch is kept checked out in a git worktree under .nbcache/,
+together with a manifest of the sha256 of every published file
+(.publish-manifest.json). Publishing hashes Book/_build/html, copies only
+the files whose hash differs from the manifest, deletes the files that
+are gone, and commits and pushes just those, so the time it takes
+follows the size of the edit rather than the size of the book.
+
+Usage (from the repository root, after building):
+
+    python -m booktools.publish [--no-push]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HTML_DIR = os.path.join(ROOT, 'Book', '_build', 'html')
+WORKTREE = os.path.join(ROOT, '.nbcache', 'publish')
+MANIFEST = '.publish-manifest.json'
+
+
+def git(*args, cwd=ROOT, check=True, input=None):
+    # Failures are expected where check is False, so keep git quiet then
+    result = subprocess.run(['git'] + list(args), cwd=cwd, input=input,
+                            stdout=subprocess.PIPE,
+                            stderr=None if check else subprocess.DEVNULL,
+                            universal_newlines=True)
+    if check and result.returncode:
+        raise SystemExit('git %s failed' % ' '.join(args))
+    return result
+
+
+def tree_manifest(top):
+    """Map each file under top (relative, with /) to its sha256."""
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = [d for d in dirnames if d != '.git']
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, top).replace(os.sep, '/')
+            if rel == MANIFEST or name == '.git':
+                continue
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            manifest[rel] = h.hexdigest()
+    return manifest
+
+
+def open_worktree(remote, branch):
+    """Check out branch in WORKTREE, up to date with remote."""
+    fetched = git('fetch', '-q', remote, branch, check=False).returncode == 0
+    if not os.path.isdir(WORKTREE):
+        os.makedirs(os.path.dirname(WORKTREE), exist_ok=True)
+        git('worktree', 'prune')
+        if fetched:
+            git('worktree', 'add', '-q', '-B', branch, WORKTREE,
+                '%s/%s' % (remote, branch))
+        elif git('rev-parse', '-q', '--verify', 'refs/heads/' + branch,
+                 check=False).returncode == 0:
+            git('worktree', 'add', '-q', WORKTREE, branch)
+        else:
+            git('worktree', 'add', '-q', '--detach', WORKTREE)
+            git('checkout', '-q', '--orphan', branch, cwd=WORKTREE)
+            git('rm', '-rfq', '--ignore-unmatch', '.', cwd=WORKTREE)
+    elif fetched:
+        # Drop anything that was committed here but never pushed
+        git('reset', '-q', '--hard', '%s/%s' % (remote, branch), cwd=WORKTREE)
+
+
+def published_manifest():
+    """Return the manifest of what is in WORKTREE."""
+    try:
+        with open(os.path.join(WORKTREE, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # First publish over a tree made by ghp-import
+        return tree_manifest(WORKTREE)
+
+
+def diff(old, new):
+    """Return the files that changed and the files that were removed."""
+    changed = sorted(rel for rel in new if old.get(rel) != new[rel])
+    removed = sorted(rel for rel in old if rel not in new)
+    return changed, removed
+
+
+def stage(changed, removed):
+    """Bring the changes into WORKTREE and git add them with the manifest."""
+    for rel in changed:
+        target = os.path.join(WORKTREE, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(os.path.join(HTML_DIR, rel), target)
+    for rel in removed:
+        try:
+            os.remove(os.path.join(WORKTREE, rel))
+        except FileNotFoundError:
+            pass
+    paths = changed + removed + [MANIFEST]
+    git('add', '-A', '--pathspec-from-file=-', cwd=WORKTREE,
+        input='\n'.join(paths) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publishes \
+        Book/_build/html to GitHub Pages, pushing only the files that \
+        changed since the last publish.")
+    parser.add_argument('--remote', default='origin', help='The remote to \
+        publish to (default: origin).')
+    parser.add_argument('--branch', default='gh-pages', help='The branch \
+        to publish to (default: gh-pages).')
+    parser.add_argument('-n', '--no-push', help='Commit the changes to the \
+        branch but do not push them.', action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.isdir(HTML_DIR):
+        print('Nothing to publish: %s does not exist.' % HTML_DIR)
+        return 1
+    # Tell GitHub Pages not to run the site through Jekyll, as ghp-import -n
+    open(os.path.join(HTML_DIR, '.nojekyll'), 'a').close()
+
+    open_worktree(args.remote, args.branch)
+    new = tree_manifest(HTML_DIR)
+    changed, removed = diff(published_manifest(), new)
+    print('%d file(s) changed, %d removed, %d unchanged.'
+          % (len(changed), len(removed), len(new) - len(changed)))
+    if not changed and not removed:
+        return 0
+
+    with open(os.path.join(WORKTREE, MANIFEST), 'w') as f:
+        json.dump(new, f, indent=0, sort_keys=True)
+    stage(changed, removed)
+    git('commit', '-q', '-m', 'Update book: %d changed, %d removed'
+        % (len(changed), len(removed)), cwd=WORKTREE)
+    if not args.no_push:
+        git('push', '-q', args.remote, 'HEAD:refs/heads/' + args.branch,
+            cwd=WORKTREE)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# coding: utf-8
+"""Choosing which notebooks to run, and in what order.
+
+The chapters are listed in yaml/_toc.yml, and the journal written by
+run_notebooks.py (see booktools.journal) remembers how long each one took
+the last time it was executed. With several workers the notebooks are
+started longest first, which keeps the slow chapters from being left
+until the end (the classic longest-processing-time rule for minimising
+the makespan). Notebooks with no history are assumed to be as slow as
+the slowest known one.
+"""
+
+import os
+
+import nbformat
+
+from booktools.cache import data_files
+
+
+def toc_notebooks(toc_path, source_dir):
+    """Return the paths of the .ipynb files in toc_path, in book order."""
+    import yaml
+    with open(toc_path) as f:
+        toc = yaml.safe_load(f)
+    files = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if str(node.get('file', '')).endswith('.ipynb'):
+                files.append(os.path.join(source_dir, node['file']))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(toc)
+    return files
+
+
+def data_usage(notebooks, data_dir):
+    """Map each notebook name to the set of data file names it reads."""
+    usage = {}
+    for n in notebooks:
+        nb = nbformat.read(n + '.ipynb', as_version=4)
+        usage[n] = {os.path.basename(f) for f in data_files(nb, data_dir)}
+    return usage
+
+
+def affected_by(notebooks, changed, data_dir):
+    """Return the notebooks that read any of the changed data files."""
+    changed = {os.path.basename(f) for f in changed}
+    usage = data_usage(notebooks, data_dir)
+    return [n for n in notebooks if usage[n] & changed]
+
+
+def estimates(notebooks, journal):
+    """Expected run time of each notebook from its last successful run."""
+    known = {}
+    for n in notebooks:
+        seconds = journal.seconds.get(os.path.abspath(n + '.ipynb'))
+        if seconds is not None:
+            known[n] = seconds
+    default = max(known.values()) if known else 1.0
+    return {n: known.get(n, default) for n in notebooks}
+
+
+def longest_first(notebooks, times, jobs):
+    """Order notebooks longest first and estimate the resulting makespan."""
+    order = sorted(notebooks, key=lambda n: times[n], reverse=True)
+    workers = [0.0] * max(jobs, 1)
+    for n in order:
+        i = workers.index(min(workers))
+        workers[i] += times[n]
+    return order, max(workers) if order else 0.0
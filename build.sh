@@ -1,11 +1,14 @@
 #!/bin/bash
 
-# build html documents
-jupyter-book build /Users/ethan/Documents/GitHub/pythonbook/Chapters/ --path-output /Users/ethan/Documents/GitHub/pythonbook/Book --config /Users/ethan/Documents/GitHub/pythonbook/yaml/_config.yml --toc /Users/ethan/Documents/GitHub/pythonbook/yaml/_toc.yml
+cd "$(dirname "$0")"
 
-# push to GitHub
+# build html documents, re-executing only notebooks whose code or data changed
+# (use "python -m booktools.build --force" to re-execute everything)
+python -m booktools.build || exit 1
 
-ghp-import -n -p -f Book/_build/html
+# push to GitHub, uploading only the pages that changed since the last publish
+
+python -m booktools.publish || exit 1
 
 git add -A
 git commit -m "auto-updated with build.sh"
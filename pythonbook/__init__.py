@@ -0,0 +1 @@
+"""Code shared by the chapters of Learning Statistics with Python."""
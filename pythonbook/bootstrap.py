@@ -0,0 +1,193 @@
+# coding: utf-8
+"""Bootstrap confidence intervals for any statistic.
+
+bootstrap() draws reps resamples of a data column as a (reps x n) matrix
+of indices, in chunks, and computes the statistic along each row, so
+10**5 resamples cost a handful of NumPy calls. interval() turns them
+into a confidence interval by one of three methods:
+
+    percentile   the quantiles of the bootstrap distribution
+    bca          bias-corrected and accelerated (Efron 1987)
+    studentised  bootstrap-t, from the resampled t statistics
+
+    from pythonbook import datasets
+    from pythonbook.bootstrap import interval
+    parenthood = datasets.load('parenthood')
+    interval(parenthood['dan_sleep'], 'median', method='bca')
+    interval(datasets.load('clintrial').groupby('drug')['mood_gain'])
+
+Statistics are named as in pythonbook.sampling (mean, sd, median, ...)
+or given as functions f(samples, axis). The resamples are split over the
+shards of pythonbook.rng.sharded(), so the result for a seed is the same
+whether they are drawn in one process or in several.
+"""
+
+import functools
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from pythonbook import rng as streams
+from pythonbook import sampling
+
+METHODS = ('percentile', 'bca', 'studentised')
+
+Interval = namedtuple('Interval', 'estimate low high se')
+
+
+def _resample(gen, size, data, statistic, inner, chunk):
+    """Return the statistic of size resamples of data, and their se's.
+
+    Unless inner is None, the second row is the standard error of each
+    resample's statistic: the standard error of the mean if inner is 0,
+    otherwise the sd of the statistic over inner resamples of the
+    resample.
+    """
+    n = len(data)
+    out = np.empty((1 if inner is None else 2, size))
+    rows = max(1, chunk // (n * max(inner or 1, 1)))
+    for start in range(0, size, rows):
+        stop = min(start + rows, size)
+        samples = data[gen.integers(0, n, (stop - start, n))]
+        out[0, start:stop] = statistic(samples, axis=1)
+        if inner:
+            index = gen.integers(0, n, (stop - start, inner, n))
+            nested = np.take_along_axis(
+                samples[:, None, :], index, axis=2)
+            out[1, start:stop] = statistic(nested, axis=2).std(axis=1,
+                                                                ddof=1)
+        elif inner is not None:
+            out[1, start:stop] = samples.std(axis=1, ddof=1) / math.sqrt(n)
+    return out
+
+
+def bootstrap(data, statistic='mean', reps=10000, name='bootstrap',
+              seed=None, processes=1, inner=None, chunk=streams.CHUNK):
+    """Return the statistic of reps bootstrap resamples of data.
+
+    data is a one-dimensional array or Series; missing values are
+    dropped. The resamples come from the named stream of pythonbook.rng,
+    split over its shards; processes > 1 (or None, one per CPU) draws the
+    shards in a pool. With inner set, returns a (2 x reps) array whose
+    second row is the standard error of each resample's statistic (see
+    interval()).
+    """
+    data = _values(data)
+    f = sampling._statistic(statistic)
+    out = streams.sharded(_resample, reps, name=name, seed=seed,
+                          processes=processes,
+                          combine=functools.partial(np.concatenate, axis=1),
+                          data=data, statistic=f, inner=inner, chunk=chunk)
+    return out if inner is not None else out[0]
+
+
+def _values(data):
+    data = np.asarray(data, dtype=float)
+    if data.ndim != 1:
+        raise ValueError('Bootstrap data must be one column, not shape %r'
+                         % (data.shape,))
+    return data[~np.isnan(data)]
+
+
+def jackknife(data, statistic='mean', chunk=streams.CHUNK):
+    """Return the statistic of data with each observation left out."""
+    data = _values(data)
+    f = sampling._statistic(statistic)
+    n = len(data)
+    out = np.empty(n)
+    rows = max(1, chunk // n)
+    keep = np.arange(n - 1)
+    for start in range(0, n, rows):
+        left_out = np.arange(start, min(start + rows, n))[:, None]
+        out[start:start + len(left_out)] = f(
+            data[keep + (keep >= left_out)], axis=1)
+    return out
+
+
+def _bca(data, f, estimate, boot, alphas, chunk):
+    from scipy import stats
+
+    below = np.mean(boot < estimate) + np.mean(boot == estimate) / 2
+    z0 = stats.norm.ppf(below)
+    jack = jackknife(data, f, chunk)
+    d = jack.mean() - jack
+    denominator = 6 * (d ** 2).sum() ** 1.5
+    a = (d ** 3).sum() / denominator if denominator else 0.0
+    z = stats.norm.ppf(alphas)
+    adjusted = stats.norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+    return np.quantile(boot, adjusted)
+
+
+def _interval(data, statistic, confidence, method, reps, name, seed,
+              processes, inner, chunk):
+    if method not in METHODS:
+        raise ValueError('No bootstrap method %r; choose from %s'
+                         % (method, ', '.join(METHODS)))
+    data = _values(data)
+    f = sampling._statistic(statistic)
+    estimate = float(f(data, axis=0))
+    alphas = np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    if method == 'studentised':
+        # The standard error of a mean is known; other statistics need a
+        # bootstrap within each resample
+        if statistic != 'mean' and not inner:
+            inner = 50
+        elif statistic == 'mean':
+            inner = 0
+        boot, ses = bootstrap(data, f, reps, name, seed, processes, inner,
+                              chunk)
+        se = float(boot.std(ddof=1))
+        if statistic == 'mean':
+            se = float(data.std(ddof=1) / math.sqrt(len(data)))
+        # A resample of identical values has no standard error and no t
+        # statistic; leave those resamples out
+        usable = ses > 0
+        if usable.any():
+            t = np.quantile((boot[usable] - estimate) / ses[usable],
+                            alphas[::-1])
+            low, high = estimate - t * se
+        else:
+            low = high = estimate
+    else:
+        boot = bootstrap(data, f, reps, name, seed, processes, chunk=chunk)
+        se = float(boot.std(ddof=1))
+        if method == 'bca':
+            low, high = _bca(data, f, estimate, boot, alphas, chunk)
+        else:
+            low, high = np.quantile(boot, alphas)
+    return Interval(estimate, float(low), float(high), se)
+
+
+def interval(data, statistic='mean', confidence=0.95, method='percentile',
+             reps=10000, name='bootstrap', seed=None, processes=1,
+             inner=None, chunk=streams.CHUNK):
+    """Return a bootstrap confidence interval for statistic of data.
+
+    data is a one-dimensional array or Series, or a grouped column such
+    as df.groupby('drug')['mood_gain']. statistic is a name in
+    pythonbook.sampling.STATISTICS, a ufunc or a function f(samples,
+    axis). method is 'percentile', 'bca' or 'studentised'; the
+    studentised interval leaves out resamples whose standard error is 0.
+    Returns Interval(estimate, low, high, se), where se is the bootstrap
+    standard error, or for grouped data a DataFrame with those columns
+    and one row per group, each group drawn from its own stream.
+
+    The studentised interval of a statistic other than the mean is much
+    slower than the others: it estimates the standard error of each
+    resample from inner (default 50) resamples of it, so it computes the
+    statistic reps * inner times. For 10**5 resamples of 100 values that
+    is some 10 s for the sd and 20 s for the median, against a fraction
+    of a second for the other methods. Use fewer reps, a smaller inner or
+    processes=None to spread the work over the CPUs.
+    """
+    if hasattr(data, 'groups'):
+        import pandas as pd
+        rows = {key: _interval(group, statistic, confidence, method, reps,
+                               '%s:%s' % (name, key), seed, processes,
+                               inner, chunk)
+                for key, group in data}
+        return pd.DataFrame.from_dict(rows, orient='index',
+                                      columns=Interval._fields)
+    return _interval(data, statistic, confidence, method, reps, name, seed,
+                     processes, inner, chunk)
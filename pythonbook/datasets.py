@@ -0,0 +1,301 @@
+# coding: utf-8
+"""The book's data sets, loaded from the local Data/ directory.
+
+The chapters read their data with
+
+    pd.read_csv('https://raw.githubusercontent.com/ethanweed/pythonbook/main/Data/parenthood.csv')
+
+so that readers can copy the code as it is. When the book itself is built
+there is no need to go to the network for files that are sitting in
+Data/. This module resolves a data set name, file name or book URL to the
+local file, checks it against Data/SHA256SUMS and keeps the parsed
+DataFrame for the rest of the process:
+
+    from pythonbook import datasets
+    parenthood = datasets.load('parenthood')
+
+install() makes pandas.read_csv do the same for the book's URLs, without
+touching the chapters; build.sh and run_notebooks.py --local-data do that
+in every kernel through kernel_startup.py.
+
+With pyarrow installed, each CSV file is parsed only once: it is converted
+to an Arrow IPC file in .nbcache/data/, with the column types fixed by
+that first parse and the columns in CATEGORICAL dictionary-encoded, and
+later loads memory-map that file instead of parsing text. The Arrow file
+records the checksum of the CSV it came from and is rebuilt when the CSV
+changes. booktools.build converts all of them before the build.
+
+To refresh the checksums after editing a data file, or to convert every
+file ahead of time:
+
+    python -m pythonbook.datasets --update
+    python -m pythonbook.datasets --convert
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+
+from pythonbook import paths
+
+ROOT = paths.root()
+DATA_DIR = os.path.join(ROOT, 'Data')
+CHECKSUMS = os.path.join(DATA_DIR, 'SHA256SUMS')
+ARROW_DIR = os.path.join(ROOT, '.nbcache', 'data')
+BOOK_URLS = ('https://raw.githubusercontent.com/ethanweed/pythonbook/main/Data/',
+             'https://github.com/ethanweed/pythonbook/raw/main/Data/')
+
+# Columns stored as categories in the Arrow files
+CATEGORICAL = ('drug', 'therapy', 'tutor', 'species', 'choice')
+SOURCE_KEY = b'pythonbook.source_sha256'
+
+# Parsed data sets, keyed by file, file version and read_csv arguments
+_frames = {}
+# Memory-mapped Arrow tables, keyed by file and file version
+_tables = {}
+_checksums = None
+_pandas_read_csv = None
+
+
+def names():
+    """Return the names of the available data sets."""
+    return sorted(f[:-4] for f in os.listdir(DATA_DIR) if f.endswith('.csv'))
+
+
+def path(name):
+    """Return the local file for a data set name, file name or book URL.
+
+    Raises KeyError if there is no such data set.
+    """
+    name = os.fspath(name)
+    for url in BOOK_URLS:
+        if name.startswith(url):
+            name = name[len(url):]
+    local = paths.resolve(name)
+    if local is not None and os.path.dirname(local) == DATA_DIR:
+        return local
+    name = os.path.basename(name)
+    if not name.endswith('.csv'):
+        name += '.csv'
+    local = os.path.join(DATA_DIR, name)
+    if not os.path.isfile(local):
+        raise KeyError('No data set called %r in %s' % (name, DATA_DIR))
+    return local
+
+
+def _sha256(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def checksums():
+    """Return the expected sha256 of each data file, from Data/SHA256SUMS."""
+    global _checksums
+    if _checksums is None:
+        _checksums = {}
+        if os.path.exists(CHECKSUMS):
+            with open(CHECKSUMS) as f:
+                for line in f:
+                    if line.strip():
+                        digest, filename = line.split(None, 1)
+                        _checksums[filename.strip().lstrip('*')] = digest
+    return _checksums
+
+
+def verify(name):
+    """Check a data file against its checksum.
+
+    Raises ValueError if the file does not match. Files that have no
+    checksum yet are accepted.
+    """
+    local = path(name)
+    expected = checksums().get(os.path.basename(local))
+    if expected is not None and _sha256(local) != expected:
+        raise ValueError('%s does not match its checksum in %s; run '
+                         '"python -m pythonbook.datasets --update" if the '
+                         'change is intended.' % (local, CHECKSUMS))
+    return local
+
+
+def arrow_path(name):
+    """Return the Arrow file a data set is converted to."""
+    return os.path.join(ARROW_DIR, os.path.basename(path(name))[:-4] + '.arrow')
+
+
+def _arrow_source(filename):
+    """Return the CSV checksum recorded in an Arrow file, or None."""
+    import pyarrow
+    try:
+        with pyarrow.memory_map(filename) as source:
+            schema = pyarrow.ipc.open_file(source).schema
+    except (OSError, pyarrow.ArrowInvalid):
+        return None
+    return (schema.metadata or {}).get(SOURCE_KEY, b'').decode() or None
+
+
+def convert(name, force=False):
+    """Convert a data set to its Arrow file, unless that is up to date.
+
+    Returns True if the file was written.
+    """
+    import pandas
+    import pyarrow
+
+    local = verify(name)
+    target = arrow_path(local)
+    digest = _sha256(local)
+    if not force and _arrow_source(target) == digest:
+        return False
+    read_csv = _pandas_read_csv or pandas.read_csv
+    frame = read_csv(local)
+    for column in CATEGORICAL:
+        if column in frame:
+            frame[column] = frame[column].astype('category')
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_KEY] = digest.encode()
+    table = table.replace_schema_metadata(metadata)
+    os.makedirs(ARROW_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=ARROW_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        with pyarrow.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, target)
+    return True
+
+
+def convert_all(force=False):
+    """Convert every data set; returns the names that were (re)written."""
+    return [name for name in names() if convert(name, force)]
+
+
+def table(name):
+    """Return a data set as a memory-mapped pyarrow Table.
+
+    The Arrow file is written first if it is missing or out of date.
+    """
+    import pyarrow
+
+    local = path(name)
+    stat = os.stat(local)
+    key = (local, stat.st_mtime_ns, stat.st_size)
+    if key not in _tables:
+        convert(local)
+        with pyarrow.memory_map(arrow_path(local)) as source:
+            _tables[key] = pyarrow.ipc.open_file(source).read_all()
+    return _tables[key]
+
+
+def _has_arrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def load(name, categories=True, **kwargs):
+    """Return a data set as a DataFrame.
+
+    Without read_csv keyword arguments the frame comes from the
+    memory-mapped Arrow file, if pyarrow is available; categories=False
+    turns the CATEGORICAL columns back into plain strings, as read_csv
+    would give them. Otherwise the file is parsed once per process (for
+    each set of read_csv keyword arguments). Either way each call returns
+    a new frame, so changes made by one chapter cell never show up in
+    another.
+    """
+    if not kwargs and _has_arrow():
+        frame = table(name).to_pandas()
+        if not categories:
+            for column in CATEGORICAL:
+                if column in frame:
+                    frame[column] = frame[column].astype(str)
+        return frame
+    local = path(name)
+    stat = os.stat(local)
+    key = (local, stat.st_mtime_ns, stat.st_size, repr(sorted(kwargs.items())))
+    if key not in _frames:
+        import pandas
+        verify(local)
+        read_csv = _pandas_read_csv or pandas.read_csv
+        _frames[key] = read_csv(local, **kwargs)
+    return _frames[key].copy()
+
+
+def _is_book_data(filepath):
+    if not isinstance(filepath, (str, os.PathLike)):
+        return False
+    filepath = os.fspath(filepath)
+    if filepath.startswith(BOOK_URLS):
+        return True
+    if '://' in filepath:
+        return False
+    # Also a missing local path, such as a file name relative to another
+    # directory or an absolute path on the author's machine
+    local = paths.resolve(filepath)
+    return local is not None and os.path.dirname(local) == DATA_DIR
+
+
+def read_csv(filepath_or_buffer, *args, **kwargs):
+    """pandas.read_csv, reading the book's data files from Data/."""
+    if not args and _is_book_data(filepath_or_buffer):
+        return load(filepath_or_buffer, categories=False, **kwargs)
+    import pandas
+    read = _pandas_read_csv or pandas.read_csv
+    return read(filepath_or_buffer, *args, **kwargs)
+
+
+def install():
+    """Make pandas.read_csv use read_csv() for the book's data files."""
+    global _pandas_read_csv
+    import pandas
+    if _pandas_read_csv is None:
+        _pandas_read_csv = pandas.read_csv
+        pandas.read_csv = read_csv
+
+
+def write_checksums():
+    """Write Data/SHA256SUMS for every data file."""
+    global _checksums
+    with open(CHECKSUMS, 'w') as f:
+        for name in names():
+            f.write('%s  %s.csv\n' % (_sha256(path(name)), name))
+    _checksums = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the data files \
+        against Data/SHA256SUMS.")
+    parser.add_argument('--update', help='Rewrite Data/SHA256SUMS from the \
+        current files instead.', action='store_true')
+    parser.add_argument('--convert', help='Convert the data files to Arrow \
+        files in %s instead.' % os.path.relpath(ARROW_DIR, ROOT),
+        action='store_true')
+    parser.add_argument('-f', '--force', help='With --convert, rewrite the \
+        Arrow files even if they are up to date.', action='store_true')
+    args = parser.parse_args()
+    if args.update:
+        write_checksums()
+        return 0
+    if args.convert:
+        written = convert_all(args.force)
+        print('%d data file(s), %d converted.' % (len(names()), len(written)))
+        return 0
+    bad = 0
+    for name in names():
+        try:
+            verify(name)
+        except ValueError as e:
+            print(e)
+            bad += 1
+    print('%d data file(s), %d changed.' % (len(names()), bad))
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
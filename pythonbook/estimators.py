@@ -0,0 +1,166 @@
+# coding: utf-8
+"""Bias, variance and mean squared error of estimators, by sample size.
+
+study() draws reps samples of each size n in a grid from a population,
+evaluates every estimator on the same samples, and compares the
+estimates with the population value each estimator is aiming at:
+
+    from pythonbook.estimators import study
+    result = study(['mean', 'sd', 'sd0', 'median', 'trimmed'], range(2, 11))
+    result.bias      # long format: n, estimator, value, se
+
+The se column is a bootstrap standard error, obtained by resampling the
+reps estimates, so it can be drawn as error bars. The sample sizes are
+independent of each other, so they are simulated in a pool of processes;
+each has its own substream, so the results do not depend on the number
+of processes.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pythonbook import rng as streams
+from pythonbook import sampling
+
+# Proportion cut from each end by the trimmed mean
+TRIM = 0.1
+
+Study = namedtuple('Study', 'bias variance mse')
+
+# What is measured for each estimator, in the order of the Study fields
+MEASURES = Study._fields
+
+
+def _trimmed(samples, axis):
+    from scipy import stats
+    return stats.trim_mean(samples, TRIM, axis=axis)
+
+
+def _trimmed_parameter(population):
+    return population.expect(lb=population.ppf(TRIM),
+                             ub=population.ppf(1 - TRIM), conditional=True)
+
+
+# name: (statistic, parameter f(population), smallest n), where the
+# statistic is a name in pythonbook.sampling.STATISTICS or f(samples, axis)
+ESTIMATORS = {
+    'mean': ('mean', lambda p: p.mean(), 1),
+    'sd': ('sd', lambda p: p.std(), 2),
+    'sd0': (np.std, lambda p: p.std(), 1),
+    'median': ('median', lambda p: p.median(), 1),
+    'trimmed': (_trimmed, _trimmed_parameter, 1),
+}
+
+
+def register(name, statistic, parameter, smallest=1):
+    """Make an estimator available to study() as name.
+
+    statistic is a name in pythonbook.sampling.STATISTICS or a
+    module-level function f(samples, axis) returning one estimate per
+    row, parameter a function f(population) returning the
+    value it estimates, and smallest the smallest sample size for which
+    it is defined.
+    """
+    ESTIMATORS[name] = (statistic, parameter, smallest)
+
+
+def _estimator(name):
+    try:
+        return ESTIMATORS[name]
+    except KeyError:
+        raise KeyError('No estimator called %r; choose from %s or '
+                       'register() it' % (name, ', '.join(sorted(ESTIMATORS))))
+
+
+def _measures(estimates, truth):
+    """Return bias, variance and MSE of each row of estimates."""
+    errors = estimates - truth
+    bias = errors.mean(axis=-1)
+    return np.stack([bias, estimates.var(axis=-1, ddof=1),
+                     (errors ** 2).mean(axis=-1)])
+
+
+def _bootstrap_se(estimates, truth, boot, gen, chunk):
+    """Return the bootstrap standard errors of _measures(estimates)."""
+    reps = len(estimates)
+    draws = []
+    rows = max(1, chunk // reps)
+    for start in range(0, boot, rows):
+        index = gen.integers(0, reps, (min(rows, boot - start), reps))
+        draws.append(_measures(estimates[index], truth))
+    return np.concatenate(draws, axis=1).std(axis=1, ddof=1)
+
+
+def _study_point(gen, n, reps, estimators, truths, population, boot, chunk):
+    """Return (estimators x measures x [value, se]) for one sample size."""
+    estimates = np.full((len(estimators), reps), np.nan)
+    rows = max(1, chunk // n)
+    for start in range(0, reps, rows):
+        stop = min(start + rows, reps)
+        samples = population(gen, (stop - start, n))
+        for i, (statistic, smallest) in enumerate(estimators):
+            if n >= smallest:
+                estimates[i, start:stop] = statistic(samples, axis=1)
+
+    result = np.full((len(estimators), len(MEASURES), 2), np.nan)
+    for i, (statistic, smallest) in enumerate(estimators):
+        if n >= smallest:
+            result[i, :, 0] = _measures(estimates[i], truths[i])
+            result[i, :, 1] = _bootstrap_se(estimates[i], truths[i], boot,
+                                            gen, chunk)
+    return result
+
+
+def study(estimators, ns, reps=10000, population=None, boot=200, rng=None,
+          processes=None, chunk=streams.CHUNK):
+    """Return the bias, variance and MSE of estimators for each n in ns.
+
+    estimators are names in ESTIMATORS: 'mean', 'sd' (ddof=1), 'sd0'
+    (ddof=0), 'median' and 'trimmed' (the mean with TRIM cut from each
+    end). population is a scipy.stats frozen distribution, by default
+    normal with mean 100 and sd 15 like the book's IQ scores. Returns
+    Study(bias, variance, mse), each a long-format DataFrame with columns
+    'n', 'estimator', 'value' and 'se', the bootstrap standard error of
+    value from boot resamples. An estimator is NaN for sample sizes too
+    small for it (the sd of one observation). rng is a Generator or a
+    seed, by default the 'estimators' stream of pythonbook.rng; each
+    sample size draws from a stream spawned from it. processes=1 runs
+    everything in this process.
+    """
+    import pandas as pd
+    from scipy import stats
+
+    if isinstance(estimators, str):
+        estimators = [estimators]
+    specs = [_estimator(name) for name in estimators]
+    if population is None:
+        population = stats.norm(100, 15)
+    truths = [float(parameter(population)) for s, parameter, m in specs]
+    ns = list(ns)
+    gens = streams.generator(rng, 'estimators').spawn(len(ns))
+    # The parameters need not be picklable; only the statistics are sent
+    statistics = [(sampling._statistic(statistic), smallest)
+                  for statistic, p, smallest in specs]
+    work = [(gen, n, reps, statistics, truths,
+             streams.sampler(population), boot, chunk)
+            for gen, n in zip(gens, ns)]
+    if processes == 1 or len(work) == 1:
+        results = [_study_point(*w) for w in work]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_study_point, *w) for w in work]
+            results = [f.result() for f in futures]
+
+    results = np.stack(results)    # n x estimator x measure x [value, se]
+    tables = []
+    for m in range(len(MEASURES)):
+        tables.append(pd.DataFrame({
+            'n': np.repeat(ns, len(specs)),
+            'estimator': pd.Categorical(np.tile(estimators, len(ns)),
+                                        categories=list(estimators)),
+            'value': results[:, :, m, 0].ravel(),
+            'se': results[:, :, m, 1].ravel(),
+        }))
+    return Study(*tables)
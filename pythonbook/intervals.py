@@ -0,0 +1,71 @@
+# coding: utf-8
+"""Confidence intervals for many samples at once, and their coverage.
+
+t_intervals() computes the t confidence interval of the mean for every
+row of a (samples x n) array from the row means and standard errors;
+the t critical value is looked up once per (df, confidence) and cached.
+coverage() uses it to estimate how often the interval contains the true
+mean, together with the Monte Carlo error of that estimate:
+
+    from pythonbook.intervals import coverage
+    coverage(n=10, confidence=0.95, reps=10**6)
+"""
+
+import functools
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from pythonbook import rng as streams
+
+Coverage = namedtuple('Coverage', 'coverage error reps')
+
+
+@functools.lru_cache(maxsize=None)
+def t_critical(df, confidence=0.95):
+    """Return the two-sided t critical value for df degrees of freedom."""
+    from scipy import stats
+    return float(stats.t.ppf((1 + confidence) / 2, df))
+
+
+def t_intervals(samples, confidence=0.95):
+    """Return (lowers, uppers), the t interval of the mean of each row."""
+    samples = np.asarray(samples)
+    n = samples.shape[1]
+    means = samples.mean(axis=1)
+    half = (t_critical(n - 1, confidence)
+            * samples.std(axis=1, ddof=1) / math.sqrt(n))
+    return means - half, means + half
+
+
+def _normal(mean, sd):
+    return lambda gen, shape: gen.normal(mean, sd, shape)
+
+
+def coverage(n, confidence=0.95, reps=100000, mean=100, sd=15,
+             population=None, rng=None, chunk=streams.CHUNK):
+    """Estimate how often the t interval from n observations contains mean.
+
+    Draws reps samples of size n, by default from a normal distribution
+    with the given mean and sd, or from population, a function f(gen,
+    shape) or a scipy.stats frozen distribution whose mean is mean.
+    Returns Coverage(coverage, error, reps), where error is the Monte
+    Carlo standard error of the coverage. rng is a numpy Generator or a
+    seed, by default the 'coverage' stream of pythonbook.rng.
+    """
+    if n < 2:
+        raise ValueError('A t interval needs at least 2 observations')
+    rng = streams.generator(rng, 'coverage')
+    if population is None:
+        population = _normal(mean, sd)
+    population = streams.sampler(population)
+
+    hits = 0
+    rows = max(1, chunk // n)
+    for start in range(0, reps, rows):
+        size = min(rows, reps - start)
+        lowers, uppers = t_intervals(population(rng, (size, n)), confidence)
+        hits += int(np.count_nonzero((lowers <= mean) & (mean <= uppers)))
+    p = hits / reps
+    return Coverage(p, math.sqrt(p * (1 - p) / reps), reps)
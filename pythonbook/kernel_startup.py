@@ -0,0 +1,7 @@
+# coding: utf-8
+# Run by IPython when a kernel starts during a book build (it is passed as
+# PYTHONSTARTUP), so that the chapters read the book's data files from Data/
+# instead of downloading them. See pythonbook/datasets.py.
+import pythonbook.datasets
+pythonbook.datasets.install()
+del pythonbook
@@ -0,0 +1,71 @@
+# coding: utf-8
+"""Locations of files in the book's repository.
+
+Code that reads the book's files should not depend on the working
+directory or on where the author keeps the repository. Ask this module
+instead:
+
+    from pythonbook import paths
+    df = pd.read_csv(paths.data('skewdata.csv'))
+
+The repository root is the directory above this package, or
+$PYTHONBOOK_ROOT if that is set. resolve() maps a path written for
+another machine, such as '/Users/ethan/Documents/GitHub/pythonbook/Data/
+booksales.csv', to the same file in this checkout.
+"""
+
+import os
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def root():
+    """Return the absolute path of the repository root."""
+    return os.path.abspath(os.environ.get('PYTHONBOOK_ROOT') or _PACKAGE_ROOT)
+
+
+def _under(directory, parts):
+    target = os.path.join(root(), directory, *parts)
+    if not os.path.exists(target):
+        raise FileNotFoundError('No such file in the book: %s' % target)
+    return target
+
+
+def data(*parts):
+    """Return the path of a file in Data/; FileNotFoundError if missing."""
+    return _under('Data', parts)
+
+
+def chapters(*parts):
+    """Return the path of a file in Chapters/; FileNotFoundError if missing."""
+    return _under('Chapters', parts)
+
+
+def images(*parts):
+    """Return the path of a file in img/; FileNotFoundError if missing."""
+    return _under('img', parts)
+
+
+def resolve(path):
+    """Return the file in this repository that path refers to.
+
+    Paths that exist are returned as they are (made absolute). Otherwise
+    the longest tail of path that names a file under the repository root
+    is used, and then a file of the same name in Data/, so that both
+    '/Users/ethan/Documents/GitHub/pythonbook/Data/booksales.csv' and
+    'booksales.csv' resolve to Data/booksales.csv. Returns None if there
+    is no such file.
+    """
+    path = os.fspath(path)
+    if os.path.exists(path):
+        return os.path.abspath(path)
+    parts = [p for p in path.replace('\\', '/').split('/') if p]
+    for i in range(len(parts)):
+        candidate = os.path.join(root(), *parts[i:])
+        if os.path.isfile(candidate):
+            return candidate
+    if parts:
+        candidate = os.path.join(root(), 'Data', parts[-1])
+        if os.path.isfile(candidate):
+            return candidate
+    return None
@@ -0,0 +1,121 @@
+# coding: utf-8
+"""Exact power of the two-sided binomial test, and the sample size needed.
+
+The test of H0: theta = theta0 rejects when X <= lo or X >= hi, where the
+critical region (lo, hi) is the equal-tailed one that keeps each tail at
+or below alpha / 2 under H0. Regions are computed for many n in one call
+and remembered per (n, alpha, theta0), so a power curve over a grid of
+theta and n costs two vectorised binomial CDF calls:
+
+    from pythonbook.power import power, curve, sample_size
+    power(0.7, 100)                                # one value
+    curve(np.arange(0.01, 1, 0.01), [25, 50, 100]) # long format for seaborn
+    sample_size(0.8, theta=0.55)                   # smallest N with 80% power
+
+sample_size() searches on the exact power, so it is as happy with an
+effect that needs ten million observations as with one that needs ten.
+"""
+
+import numpy as np
+
+# (alpha, theta0): {n: (lo, hi)}
+_regions = {}
+
+
+def _compute_regions(n, alpha, theta0):
+    from scipy.stats import binom
+
+    half = alpha / 2
+    lo = binom.ppf(half, n, theta0)
+    lo = np.where(binom.cdf(lo, n, theta0) > half, lo - 1, lo)
+    # The smallest k with P(X > k) <= alpha / 2; reject above it
+    hi = binom.ppf(1 - half, n, theta0)
+    hi = np.where(binom.sf(hi - 1, n, theta0) <= half, hi - 1, hi)
+    return lo.astype(np.int64), hi.astype(np.int64) + 1
+
+
+def critical_region(n, alpha=0.05, theta0=0.5):
+    """Return (lo, hi): the test rejects when X <= lo or X >= hi.
+
+    n may be an array, in which case lo and hi are arrays of its shape.
+    lo is -1 when no count is extreme enough in the lower tail, and hi is
+    n + 1 likewise.
+    """
+    n = np.asarray(n, dtype=np.int64)
+    cache = _regions.setdefault((alpha, theta0), {})
+    unique = np.unique(n)
+    missing = np.array([k for k in unique.tolist() if k not in cache],
+                       dtype=np.int64)
+    if len(missing):
+        lo, hi = _compute_regions(missing, alpha, theta0)
+        cache.update(zip(missing.tolist(), zip(lo.tolist(), hi.tolist())))
+    table = np.array([cache[k] for k in unique.tolist()],
+                     dtype=np.int64).reshape(-1, 2)
+    position = np.searchsorted(unique, n)
+    return table[position, 0], table[position, 1]
+
+
+def power(theta, n, alpha=0.05, theta0=0.5):
+    """Return the probability that the test rejects H0 if theta is true.
+
+    theta and n broadcast against each other, so power(theta[:, None],
+    ns) is the whole (theta x n) grid.
+    """
+    from scipy.stats import binom
+
+    theta = np.asarray(theta, dtype=float)
+    n = np.asarray(n, dtype=np.int64)
+    lo, hi = critical_region(n, alpha, theta0)
+    return binom.cdf(lo, n, theta) + binom.sf(hi - 1, n, theta)
+
+
+def curve(theta, ns, alpha=0.05, theta0=0.5):
+    """Return the power for every theta and n as a long DataFrame.
+
+    The columns are 'theta', 'n' and 'power', ready for
+    sns.lineplot(data=..., x='theta', y='power', hue='n').
+    """
+    import pandas as pd
+
+    theta = np.asarray(theta, dtype=float)
+    ns = np.asarray(ns, dtype=np.int64)
+    grid = power(theta[:, None], ns[None, :], alpha, theta0)
+    return pd.DataFrame({'theta': np.repeat(theta, len(ns)),
+                         'n': np.tile(ns, len(theta)),
+                         'power': grid.ravel()})
+
+
+def sample_size(target, theta, alpha=0.05, theta0=0.5, largest=2 ** 40):
+    """Return the smallest N for which the test has at least target power.
+
+    Because X is discrete, power zigzags as N grows. The search first
+    finds where the power crosses target by doubling and bisection, then
+    checks every N in a window below the crossing, wide enough to cover
+    the zigzag, and returns the smallest that reaches target.
+    """
+    if not alpha < target < 1:
+        raise ValueError('The target power must be between alpha (%g) and '
+                         '1, not %g' % (alpha, target))
+    if theta == theta0:
+        raise ValueError('No sample size gives more power than alpha when '
+                         'theta equals theta0')
+
+    def enough(n):
+        return power(theta, n, alpha, theta0) >= target
+
+    low, high = 1, 2
+    while not enough(high):
+        low, high = high, high * 2
+        if high > largest:
+            raise ValueError('No sample size up to %d reaches power %g'
+                             % (largest, target))
+    while high - low > 1:
+        middle = (low + high) // 2
+        if enough(middle):
+            high = middle
+        else:
+            low = middle
+
+    window = max(64, 4 * int(np.sqrt(high)))
+    candidates = np.arange(max(1, high - window), high + 1)
+    return int(candidates[enough(candidates)][0])
@@ -0,0 +1,123 @@
+# coding: utf-8
+"""Random number streams for the simulations in the book.
+
+Every simulation should take its random numbers from a numpy Generator
+handed to it, never from np.random.* or the random module, so that its
+results depend only on a seed. The streams here all derive from one
+SeedSequence:
+
+    from pythonbook import rng
+    gen = rng.stream('sampling-distribution')   # a named, independent stream
+    gens = rng.spawn(8, name='bootstrap')        # 8 independent substreams
+
+Named streams do not depend on which other streams have been used, so
+adding a simulation to a chapter does not change the numbers of the
+others. sharded() splits a simulation over independent substreams and
+runs them in a pool of processes; for a given seed and number of shards
+the result is bit-identical however many processes do the work.
+
+The simulation modules share generator(), which turns their rng argument
+into a Generator, sampler(), which turns a population into a function
+f(gen, shape), and CHUNK, the size of the blocks they draw.
+"""
+
+import functools
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# The book's seed; $PYTHONBOOK_SEED overrides it
+SEED = 42
+
+# Default number of shards. It is fixed rather than the number of CPUs
+# so that results are the same on every machine.
+SHARDS = 8
+
+# Largest number of values the simulations draw in one go; bounds the
+# memory they use
+CHUNK = 1 << 22
+
+
+def default_seed():
+    return int(os.environ.get('PYTHONBOOK_SEED', SEED))
+
+
+def seed_sequence(name=None, seed=None):
+    """Return the SeedSequence of a named stream (or the root one)."""
+    if seed is None:
+        seed = default_seed()
+    key = () if name is None else (zlib.crc32(name.encode('utf-8')),)
+    return np.random.SeedSequence(seed, spawn_key=key)
+
+
+def stream(name=None, seed=None):
+    """Return a Generator for the named stream."""
+    return np.random.Generator(np.random.PCG64(seed_sequence(name, seed)))
+
+
+def generator(rng, name):
+    """Return rng as a Generator; None means the named stream.
+
+    rng may be a Generator, a seed or anything else
+    np.random.default_rng() accepts.
+    """
+    if rng is None:
+        return stream(name)
+    return np.random.default_rng(rng)
+
+
+def _draw(frozen, gen, shape):
+    return frozen.rvs(size=shape, random_state=gen)
+
+
+def sampler(population):
+    """Return population as a function f(gen, shape) drawing samples.
+
+    population is such a function already or a scipy.stats frozen
+    distribution; the result can be sent to worker processes if
+    population can.
+    """
+    if hasattr(population, 'rvs'):
+        return functools.partial(_draw, population)
+    return population
+
+
+def spawn(n, name=None, seed=None):
+    """Return n independent Generators spawned from the named stream."""
+    return [np.random.Generator(np.random.PCG64(s))
+            for s in seed_sequence(name, seed).spawn(n)]
+
+
+def shard_sizes(total, shards):
+    """Split total replicates into shards near-equal counts."""
+    base, extra = divmod(total, shards)
+    return [base + (i < extra) for i in range(shards)]
+
+
+def _run_shard(simulate, seq, size, kwargs):
+    return simulate(np.random.Generator(np.random.PCG64(seq)), size,
+                    **kwargs)
+
+
+def sharded(simulate, total, name=None, seed=None, shards=SHARDS,
+            processes=None, combine=np.concatenate, **kwargs):
+    """Run simulate(gen, size, **kwargs) over shards and combine them.
+
+    The total replicates are split into shards, each drawn from its own
+    substream of the named stream; combine() joins the shard results in
+    shard order. processes=1 runs the shards in this process. simulate
+    must be picklable (a module-level function) to run in a pool.
+    """
+    seqs = seed_sequence(name, seed).spawn(shards)
+    sizes = shard_sizes(total, shards)
+    work = [(s, n) for s, n in zip(seqs, sizes) if n]
+    if processes == 1 or len(work) == 1:
+        results = [_run_shard(simulate, s, n, kwargs) for s, n in work]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_run_shard, simulate, s, n, kwargs)
+                       for s, n in work]
+            results = [f.result() for f in futures]
+    return combine(results)
@@ -0,0 +1,145 @@
+# coding: utf-8
+"""Sampling distributions of statistics, computed in bulk.
+
+sampling_distribution() draws reps samples of size n as a (reps x n)
+matrix and computes a statistic along each row, so 10**4 replications
+cost one NumPy call rather than a Python loop. Replications are drawn in
+chunks of rows, so 10**7 of them fit in bounded memory:
+
+    from pythonbook.sampling import sampling_distribution
+    means = sampling_distribution('mean', n=5, reps=10000)
+
+Statistics are looked up by name in STATISTICS; register() adds more. A
+statistic is a function f(samples, axis) returning one value per row, or
+a binary ufunc such as np.maximum, which is reduced along the rows.
+
+clt() shows the central limit theorem at work: the sampling distribution
+of the mean for several sample sizes, next to the normal distribution
+the theorem predicts for each.
+"""
+
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+from pythonbook import rng as streams
+
+CLT = namedtuple('CLT', 'means normal')
+
+
+def _sd(samples, axis):
+    return np.std(samples, axis=axis, ddof=1)
+
+
+def _var(samples, axis):
+    return np.var(samples, axis=axis, ddof=1)
+
+
+STATISTICS = {
+    'mean': np.mean,
+    'sd': _sd,
+    'var': _var,
+    'max': np.max,
+    'min': np.min,
+    'median': np.median,
+}
+
+
+def register(name, statistic):
+    """Make statistic available to sampling_distribution() as name."""
+    if isinstance(statistic, np.ufunc):
+        statistic = functools.partial(_reduce, statistic)
+    STATISTICS[name] = statistic
+
+
+def _reduce(ufunc, samples, axis):
+    return ufunc.reduce(samples, axis=axis)
+
+
+def iq(gen, shape):
+    """IQ scores: normal with mean 100 and sd 15, truncated to integers."""
+    return gen.normal(100, 15, shape).astype(int)
+
+
+def _statistic(statistic):
+    if isinstance(statistic, str):
+        try:
+            return STATISTICS[statistic]
+        except KeyError:
+            raise KeyError('No statistic called %r; choose from %s or '
+                           'register() it' % (statistic,
+                                              ', '.join(sorted(STATISTICS))))
+    if isinstance(statistic, np.ufunc):
+        return functools.partial(_reduce, statistic)
+    return statistic
+
+
+def _name(statistic):
+    """Return a column name for statistic."""
+    if isinstance(statistic, str):
+        return statistic
+    if isinstance(statistic, functools.partial):
+        arguments = [repr(a) for a in statistic.args] + [
+            '%s=%r' % item for item in statistic.keywords.items()]
+        return '%s(%s)' % (_name(statistic.func), ', '.join(arguments))
+    return getattr(statistic, '__name__', repr(statistic))
+
+
+def sampling_distribution(statistic, n, reps=10000, population=iq, rng=None,
+                          chunk=streams.CHUNK):
+    """Return the statistic of reps random samples of size n.
+
+    statistic is a name in STATISTICS, a ufunc or a function f(samples,
+    axis), or a list of those, in which case a DataFrame with one column
+    per statistic is returned (all computed on the same samples).
+    population draws the samples: a scipy.stats frozen distribution or a
+    function f(gen, shape), by default iq(). rng is a numpy Generator or
+    a seed, by default the 'sampling_distribution' stream of
+    pythonbook.rng.
+    """
+    names = statistic if isinstance(statistic, (list, tuple)) else [statistic]
+    funcs = [_statistic(s) for s in names]
+    rng = streams.generator(rng, 'sampling_distribution')
+    population = streams.sampler(population)
+
+    results = [np.empty(reps) for f in funcs]
+    rows = max(1, chunk // max(n, 1))
+    for start in range(0, reps, rows):
+        stop = min(start + rows, reps)
+        samples = population(rng, (stop - start, n))
+        for f, out in zip(funcs, results):
+            out[start:stop] = f(samples, axis=1)
+
+    if not isinstance(statistic, (list, tuple)):
+        return results[0]
+    import pandas as pd
+    return pd.DataFrame({_name(s): r for s, r in zip(names, results)})
+
+
+def clt(population, sizes, reps=50000, points=100, rng=None):
+    """Return the sampling distribution of the mean for each sample size.
+
+    population is a scipy.stats frozen distribution. Returns CLT(means,
+    normal): means is a long-format DataFrame with columns 'n' and 'mean'
+    (reps rows per sample size), and normal has columns 'n', 'x' and
+    'density', the normal distribution with the population mean and
+    standard deviation sigma / sqrt(n), over the population mean +/- 3
+    sigma. rng is a numpy Generator or a seed, by default the 'clt'
+    stream of pythonbook.rng.
+    """
+    import pandas as pd
+    from scipy import stats
+
+    rng = streams.generator(rng, 'clt')
+    mu, sigma = population.mean(), population.std()
+    x = np.linspace(mu - 3 * sigma, mu + 3 * sigma, points)
+    means, normal = [], []
+    for n in sizes:
+        means.append(pd.DataFrame({'n': n, 'mean': sampling_distribution(
+            'mean', n, reps, population, rng)}))
+        normal.append(pd.DataFrame({
+            'n': n, 'x': x,
+            'density': stats.norm.pdf(x, mu, sigma / np.sqrt(n))}))
+    return CLT(pd.concat(means, ignore_index=True),
+               pd.concat(normal, ignore_index=True))
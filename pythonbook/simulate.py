@@ -0,0 +1,62 @@
+# coding: utf-8
+"""Simulations used in the chapters.
+
+These draw everything for many runs at once as NumPy arrays, so that a
+figure with a thousand runs costs about as much as one with four, and
+return long-format DataFrames that go straight into seaborn.
+"""
+
+import numpy as np
+
+from pythonbook import rng as streams
+
+
+def coin_flips(n, runs=1, p=0.5, step=1, rng=None):
+    """Flip a coin n times in each of several runs.
+
+    Returns a long-format DataFrame with one row per run and flip: 'runs'
+    ('run1', 'run2', ...), 'flips' (1 to n) and 'proportion_heads', the
+    proportion of heads so far. With step > 1 only every step-th flip
+    (and the last) is kept, which keeps the frame small for long runs;
+    10**3 runs of 10**6 flips with step=1000 is a million rows. rng is a
+    numpy Generator or a seed, by default the 'coin_flips' stream of
+    pythonbook.rng.
+    """
+    import pandas as pd
+
+    if n < 1 or runs < 1 or step < 1:
+        raise ValueError('coin_flips() needs n, runs and step of at least 1')
+    rng = streams.generator(rng, 'coin_flips')
+    keep = np.arange(step, n + 1, step)
+    if not len(keep) or keep[-1] != n:
+        keep = np.append(keep, n)
+    proportion = np.empty((runs, len(keep)), dtype=np.float64)
+    rows = max(1, streams.CHUNK // max(n, 1))
+    counts = np.uint32 if n < 2 ** 32 else np.uint64
+    blocks = n // step
+    for start in range(0, runs, rows):
+        size = min(rows, runs - start)
+        if p == 0.5:
+            # A random byte is eight fair flips
+            heads = np.unpackbits(
+                rng.integers(0, 256, (size, -(-n // 8)), dtype=np.uint8),
+                axis=1, count=n)
+        else:
+            heads = rng.random((size, n), dtype=np.float32) < p
+        # Count heads per block of step flips, then accumulate the blocks
+        cumulative = []
+        if blocks:
+            per_block = heads[:, :blocks * step].reshape(size, blocks, step)
+            cumulative.append(np.cumsum(
+                per_block.sum(axis=2, dtype=counts), axis=1, dtype=counts))
+        if n % step:
+            cumulative.append(heads.sum(axis=1, dtype=counts)[:, None])
+        proportion[start:start + size] = np.hstack(cumulative) / keep
+
+    labels = ['run%d' % (i + 1) for i in range(runs)]
+    return pd.DataFrame({
+        'flips': np.tile(keep, runs),
+        'proportion_heads': proportion.ravel(),
+        'runs': pd.Categorical.from_codes(
+            np.repeat(np.arange(runs), len(keep)), labels),
+    })
@@ -3,60 +3,369 @@
 
 import os
 import argparse
+import atexit
 import glob
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import nbformat
 from nbconvert.preprocessors import ExecutePreprocessor
 from nbconvert.preprocessors.execute import CellExecutionError
 
-# Parse args
-parser = argparse.ArgumentParser(description="Runs a set of Jupyter \
-                                              notebooks.")
-file_text = """ Notebook file(s) to be run, e.g. '*.ipynb' (default),
-'my_nb1.ipynb', 'my_nb1.ipynb my_nb2.ipynb', 'my_dir/*.ipynb'
-"""
-parser.add_argument('file_list', metavar='F', type=str, nargs='*', 
-    help=file_text)
-parser.add_argument('-t', '--timeout', help='Length of time (in secs) a cell \
-    can run before raising TimeoutError (default 600).', default=600, 
-    required=False)
-parser.add_argument('-p', '--run-path', help='The path the notebook will be \
-    run from (default pwd).', default='.', required=False)
-args = parser.parse_args()
-print('Args:', args)
-if not args.file_list: # Default file_list
-    args.file_list = glob.glob('*.ipynb')
-
-# Check list of notebooks
-notebooks = []
-print('Notebooks to run:')
-for f in args.file_list:
-    # Find notebooks but not notebooks previously output from this script
-    if f.endswith('.ipynb') and not f.endswith('_out.ipynb'):
-        print(f[:-6])
-        notebooks.append(f[:-6]) # Want the filename without '.ipynb'
-
-# Execute notebooks and output
-num_notebooks = len(notebooks)
-print('*****')
-for i, n in enumerate(notebooks):
+from booktools import figures
+from booktools.blobs import BlobStore
+from booktools.cache import CellCache, cell_keys
+from booktools.guard import CellGuard, parse_size
+from booktools.journal import Journal, input_hash
+from booktools.kernels import KernelPool
+from booktools.profiling import CellProfiler, cell_rows, print_top, \
+    write_report
+from booktools.schedule import affected_by, estimates, longest_first, \
+    toc_notebooks
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT, 'Data')
+CHAPTERS_DIR = os.path.join(ROOT, 'Chapters')
+KERNEL_NAME = 'python3'
+
+# Warm kernels of this process, see get_kernel_pool()
+_kernel_pool = None
+
+# What run_notebook() reports back; cells holds the per-cell profile rows
+Result = namedtuple('Result', 'name status seconds message cells')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Runs a set of Jupyter \
+                                                  notebooks.")
+    file_text = """ Notebook file(s) to be run, e.g. '*.ipynb' (default),
+    'my_nb1.ipynb', 'my_nb1.ipynb my_nb2.ipynb', 'my_dir/*.ipynb'
+    """
+    parser.add_argument('file_list', metavar='F', type=str, nargs='*',
+        help=file_text)
+    parser.add_argument('-t', '--timeout', help='Length of time (in secs) a cell \
+        can run before raising TimeoutError (default 600).', default=600,
+        required=False)
+    parser.add_argument('-p', '--run-path', help='The path the notebook will be \
+        run from (default pwd).', default='.', required=False)
+    parser.add_argument('-j', '--jobs', help='Number of notebooks to run at \
+        the same time, each in its own worker process (default 1).',
+        type=int, default=1, required=False)
+    parser.add_argument('--cache-dir', help='Directory holding the cell \
+        output cache (default .nbcache next to this script).',
+        default=os.path.join(ROOT, '.nbcache'), required=False)
+    parser.add_argument('--no-cache', help='Execute every cell, ignoring \
+        and not updating the cell output cache.', action='store_true')
+    parser.add_argument('-w', '--warm-kernels', help='Reuse kernels that \
+        have the scientific stack already imported, resetting them between \
+        notebooks.', action='store_true')
+    parser.add_argument('--profile', help='Write the wall time, CPU time \
+        and peak memory of every executed cell to this file (.json or \
+        .csv) and print the slowest cells.', default=None, required=False)
+    parser.add_argument('--top', help='Number of slowest cells to print \
+        with --profile (default 10).', type=int, default=10, required=False)
+    parser.add_argument('--journal', help='Checkpoint file recording the \
+        notebooks that finished (default .nbcache/journal.jsonl next to \
+        this script).', default=os.path.join(ROOT, '.nbcache',
+        'journal.jsonl'), required=False)
+    parser.add_argument('-r', '--resume', help='Skip notebooks the journal \
+        records as finished whose inputs have not changed since.',
+        action='store_true')
+    parser.add_argument('--blob-dir', help='Move large outputs such as \
+        figures out of the notebook into this content-addressed store as \
+        each cell finishes, leaving references in "_out.ipynb".',
+        default=None, required=False)
+    parser.add_argument('--figure-dir', help='Pickle figures in the kernel \
+        instead of drawing them, then draw them in parallel after the \
+        notebook has run, reusing PNGs already drawn for the same figure \
+        from this directory.', default=None, required=False)
+    parser.add_argument('--local-data', help='Make pandas.read_csv read the \
+        book\'s data files from Data/ instead of downloading them.',
+        action='store_true')
+    parser.add_argument('--toc', help='Run the notebooks listed in this \
+        table of contents, e.g. yaml/_toc.yml, instead of F.', default=None,
+        required=False)
+    parser.add_argument('-d', '--data-changed', help='Only run notebooks \
+        that read one of these Data/ files.', nargs='+', default=None,
+        required=False)
+    parser.add_argument('--max-memory', help='Stop a cell when the kernel \
+        uses more than this much memory, e.g. 4G (default no limit). Cells \
+        can set their own limits with "timeout-N" and "max-memory-SIZE" \
+        tags.', type=parse_size, default=None, required=False)
+    parser.add_argument('-k', '--keep-going', help='After a cell is stopped \
+        by a time or memory limit, carry on with the rest of the notebook.',
+        action='store_true')
+    args = parser.parse_args()
+    if args.toc:
+        args.file_list = [os.path.relpath(f) for f in
+                          toc_notebooks(args.toc, CHAPTERS_DIR)]
+    elif not args.file_list: # Default file_list
+        args.file_list = glob.glob('*.ipynb')
+    return args
+
+
+def find_notebooks(file_list):
+    """Return the notebook names in file_list, without the '.ipynb'."""
+    notebooks = []
+    for f in file_list:
+        # Find notebooks but not notebooks previously output from this script
+        if f.endswith('.ipynb') and not f.endswith('_out.ipynb'):
+            notebooks.append(f[:-6]) # Want the filename without '.ipynb'
+    return notebooks
+
+
+def write_notebook(nb, path):
+    """Write nb to path atomically.
+
+    The notebook is written to a temporary file in the same directory and
+    then moved into place, so an interrupted run never leaves a truncated
+    '_out.ipynb' behind.
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.ipynb', prefix='.tmp-',
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode='wt') as f:
+            nbformat.write(nb, f)
+        # mkstemp creates the file private; give it the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def get_kernel_pool():
+    """Return this process's warm kernel pool, starting it on first use."""
+    global _kernel_pool
+    if _kernel_pool is None:
+        _kernel_pool = KernelPool(size=1, kernel_name=KERNEL_NAME)
+        atexit.register(_kernel_pool.shutdown)
+    return _kernel_pool
+
+
+def draw_figures(nb, figure_dir, blob_dir=None):
+    """Draw nb's deferred figures, offloading them with blob_dir."""
+    figures.render(nb, figure_dir)
+    if blob_dir:
+        store = BlobStore(blob_dir)
+        for cell in nb.cells:
+            store.offload(cell)
+
+
+def run_notebook(n, timeout, run_path, cache_dir=None, warm=False,
+                 max_memory=None, keep_going=False, blob_dir=None,
+                 figure_dir=None):
+    """Execute notebook n and write the result to n + '_out.ipynb'.
+
+    If cache_dir is given and every code cell is already in the cell cache,
+    the stored outputs are replayed and no kernel is started. Otherwise the
+    notebook is executed (the kernel needs the state of the unchanged cells
+    too) and the cache is refreshed.
+
+    If warm is true the notebook runs on a reset kernel from
+    get_kernel_pool() instead of a newly started one.
+
+    Each executed cell gets its timing and memory use in
+    cell.metadata['profile'], see booktools.profiling. Cells are stopped
+    when they go over their time or memory limit (timeout, max_memory or
+    their tags, see booktools.guard); with keep_going the rest of the
+    notebook still runs but the notebook is reported as 'partial'.
+
+    With blob_dir, large outputs are moved to a booktools.blobs.BlobStore
+    as soon as their cell finishes, so they are not held in memory.
+
+    With figure_dir, figures are drawn after execution by
+    booktools.figures.render() rather than in the kernel.
+
+    Returns a Result. Any error is caught here so that one failing
+    notebook never stops the others.
+    """
     n_out = n + '_out'
+    status, msg = 'ok', ''
+    start = time.time()
     with open(n + '.ipynb') as f:
         nb = nbformat.read(f, as_version=4)
-        ep = ExecutePreprocessor(timeout=int(args.timeout), kernel_name='python3')
-        try:
+    cache = CellCache(cache_dir) if cache_dir else None
+    if cache:
+        # Outputs offloaded to a blob store are cached as references into
+        # that store, so they must not be replayed without it
+        variant = 'blobs:' + os.path.abspath(blob_dir) if blob_dir else None
+        keys = cell_keys(nb, KERNEL_NAME, DATA_DIR, variant)
+        miss = cache.first_miss(keys)
+        if miss is None and cache.replay(nb, keys):
+            if figure_dir:
+                draw_figures(nb, figure_dir, blob_dir)
+            write_notebook(nb, n_out + '.ipynb')
+            return Result(n, 'cached', time.time() - start, '', [])
+        # Nothing to say if the notebook was not in the cache at all
+        first = next((i for i, key in enumerate(keys) if key is not None),
+                     None)
+        if miss != first:
+            msg = '"%s" changed from cell %s, re-executing.' % (n, miss)
+    ep = ExecutePreprocessor(timeout=int(timeout), kernel_name=KERNEL_NAME)
+    CellProfiler(ep)
+    guard = CellGuard(ep, max_memory=max_memory, keep_going=keep_going)
+    if blob_dir:
+        BlobStore(blob_dir).attach(ep)
+    if figure_dir:
+        figures.attach(ep, figure_dir)
+    km = get_kernel_pool().acquire(run_path) if warm else None
+    drawn = False
+    try:
+        ep.preprocess(nb, {'metadata': {'path': run_path}}, km=km)
+        # The cache must hold the figures, not their placeholders
+        if figure_dir:
+            draw_figures(nb, figure_dir, blob_dir)
+            drawn = True
+        if guard.tripped:
+            status = 'partial'
+            msg = 'Cells of "%s" stopped by limits: %s.\n' % (
+                n, ', '.join('%d (%s)' % t for t in guard.tripped))
+            msg += 'See notebook "%s" for details.' % n_out
+        elif cache:
+            cache.store(nb, keys)
+    except CellExecutionError:
+        status = 'error'
+        if guard.tripped:
+            status = 'timeout' if guard.tripped[-1][1] == 'timeout' \
+                else 'memory'
+        msg = 'Error executing the notebook "%s".\n' % n
+        msg += 'See notebook "%s" for the traceback.' % n_out
+    except TimeoutError:
+        status = 'timeout'
+        msg = 'Timeout executing the notebook "%s".\n' % n
+    except Exception as e:
+        status = 'error'
+        msg = 'Error running the notebook "%s": %s' % (n, e)
+    finally:
+        if km is not None:
+            get_kernel_pool().release(km, healthy=not guard.tripped)
+        if figure_dir and not drawn:
+            draw_figures(nb, figure_dir, blob_dir)
+        # Write output file
+        write_notebook(nb, n_out + '.ipynb')
+    return Result(n, status, time.time() - start, msg,
+                  cell_rows(nb, os.path.basename(n)))
+
+
+def print_summary(results, elapsed):
+    print('*****')
+    print('Summary:')
+    for r in results:
+        print('  %-45s %-8s %7.1f s' % (r.name, r.status, r.seconds))
+    failed = [r for r in results
+              if r.status not in ('ok', 'cached', 'skipped')]
+    print('%d notebook(s) run, %d failed, %.1f s total (%.1f s wall).'
+          % (len(results), len(failed),
+             sum(r.seconds for r in results), elapsed))
+    return failed
+
+
+def kernel_environment(local_data=False):
+    """Set up the environment the kernels inherit.
+
+    The repository root goes on PYTHONPATH so the chapters can import
+    pythonbook, and with local_data the kernels run
+    pythonbook/kernel_startup.py when they start.
+    """
+    paths = [ROOT] + [p for p in os.environ.get('PYTHONPATH', '').split(
+        os.pathsep) if p and p != ROOT]
+    os.environ['PYTHONPATH'] = os.pathsep.join(paths)
+    if local_data:
+        os.environ['PYTHONSTARTUP'] = os.path.join(ROOT, 'pythonbook',
+                                                   'kernel_startup.py')
+
+
+def main():
+    args = parse_args()
+    print('Args:', args)
+    kernel_environment(args.local_data)
+
+    # Check list of notebooks
+    notebooks = find_notebooks(args.file_list)
+    print('Notebooks to run:')
+    for n in notebooks:
+        print(n)
+
+    # Skip notebooks already done when resuming
+    journal = Journal(args.journal)
+    digests = {n: input_hash(n + '.ipynb', KERNEL_NAME, DATA_DIR)
+               for n in notebooks}
+    results = []
+    if args.resume:
+        for n in notebooks:
+            if (journal.done(n + '.ipynb', digests[n])
+                    and os.path.exists(n + '_out.ipynb')):
+                print('Already done, skipping', n)
+                results.append(Result(n, 'skipped', 0.0, '', []))
+    to_run = [n for n in notebooks if n not in {r.name for r in results}]
+    if args.data_changed:
+        affected = affected_by(to_run, args.data_changed, DATA_DIR)
+        for n in to_run:
+            if n not in affected:
+                print('Data unchanged, skipping', n)
+                results.append(Result(n, 'skipped', 0.0, '', []))
+        to_run = affected
+
+    def finish(result):
+        if result.message:
+            print(result.message)
+        journal.record(result.name + '.ipynb', digests[result.name],
+                       result.status, result.seconds)
+        results.append(result)
+
+    # Execute notebooks and output
+    num_notebooks = len(to_run)
+    options = dict(cache_dir=None if args.no_cache else args.cache_dir,
+                   warm=args.warm_kernels, max_memory=args.max_memory,
+                   keep_going=args.keep_going, blob_dir=args.blob_dir,
+                   figure_dir=args.figure_dir)
+    start = time.time()
+    print('*****')
+    if args.jobs > 1:
+        # Start the slowest notebooks first
+        to_run, makespan = longest_first(to_run, estimates(to_run, journal),
+                                         args.jobs)
+        print('Estimated time with %d workers: %.1f s' % (args.jobs, makespan))
+        initializer = get_kernel_pool if args.warm_kernels else None
+        with ProcessPoolExecutor(max_workers=args.jobs,
+                                 initializer=initializer) as pool:
+            futures = {}
+            for i, n in enumerate(to_run):
+                print('Queueing', n, ':', i, '/', num_notebooks)
+                futures[pool.submit(run_notebook, n, args.timeout,
+                                    args.run_path, **options)] = n
+            for future in as_completed(futures):
+                n = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process itself died
+                    result = Result(n, 'error', 0.0,
+                                    'Worker running "%s" failed: %s' % (n, e),
+                                    [])
+                print('Finished', result.name, ':', result.status)
+                finish(result)
+    else:
+        if args.warm_kernels:
+            get_kernel_pool()
+        for i, n in enumerate(to_run):
             print('Running', n, ':', i, '/', num_notebooks)
-            out = ep.preprocess(nb, {'metadata': {'path': args.run_path}})
-        except CellExecutionError:
-            out = None
-            msg = 'Error executing the notebook "%s".\n' % n
-            msg += 'See notebook "%s" for the traceback.' % n_out
-            print(msg)
-        except TimeoutError:
-            msg = 'Timeout executing the notebook "%s".\n' % n
-            print(msg)
-        finally:
-            # Write output file
-            with open(n_out + '.ipynb', mode='wt') as f:
-                nbformat.write(nb, f)
-                
\ No newline at end of file
+            finish(run_notebook(n, args.timeout, args.run_path, **options))
+
+    # Report in the order the notebooks were given
+    results.sort(key=lambda r: notebooks.index(r.name))
+    failed = print_summary(results, time.time() - start)
+    if args.profile:
+        rows = [row for r in results for row in r.cells]
+        write_report(rows, args.profile)
+        print_top(rows, args.top)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())